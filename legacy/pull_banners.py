@@ -1,17 +1,19 @@
 import argparse
 import logging
+import os
 import pathlib
 import time
+from typing import Callable, Iterable
 
-from mergedeep import Strategy, merge
 import yaml
 
 import samsara.fandom
 import samsara.generate
+from samsara.cache import PersistentPageCache
 from samsara import fandom, banners
 from samsara.banners import (
-    BannerDataset,
     BannerHistory,
+    Engines,
     coerce_chronicled_to_char_banner,
     coerce_chronicled_to_weap_banner,
 )
@@ -73,80 +75,190 @@ def get_parser() -> argparse.ArgumentParser:
         help="Minimum data size to expect (40k bytes by default), and if it falls below that then do nothing.",
     )
 
+    parser.add_argument(
+        "--page-cache",
+        action="store",
+        help="SQLite file to keep fetched page contents in between runs (disabled by default)",
+    )
+
+    parser.add_argument(
+        "--engine",
+        action="store",
+        choices=Engines,
+        default="python",
+        help="How to compute the banner histories (columnar requires numpy)",
+    )
+
+    parser.add_argument(
+        "--workers",
+        action="store",
+        type=int,
+        default=1,
+        help="Number of processes computing the banner histories (1 by default)",
+    )
+
+    parser.add_argument(
+        "--pool-size",
+        action="store",
+        type=int,
+        default=fandom.DefaultPoolSize,
+        help="Number of connections kept open to the wiki (10 by default)",
+    )
+
+    parser.add_argument(
+        "--fetch-workers",
+        action="store",
+        type=int,
+        default=fandom.DefaultFetchWorkers,
+        help="Number of category queries fetched at the same time (6 by default)",
+    )
+
+    parser.add_argument(
+        "--stream-responses",
+        action="store_true",
+        help="Decode the wiki's responses as they arrive to use less memory",
+    )
+
     return parser
 
 
+def get_content_store(
+    args: argparse.Namespace, wiki: str
+) -> PersistentPageCache | None:
+    if args.page_cache is None:
+        return None
+    return PersistentPageCache(args.page_cache, wiki)
+
+
 def main() -> None:
     logging.basicConfig(level=logging.INFO)
 
     args: argparse.Namespace = get_parser().parse_args()
+    fandom.StreamResponses = args.stream_responses
+    fandom.set_client(fandom.FandomClient(fandom.Wiki, pool_size=args.pool_size))
 
-    five_chars = fandom.get_5_star_characters()
-    five_weaps = fandom.get_5_star_weapons()
-    event_wishes = fandom.get_event_wishes()
-    chronicled_wishes = fandom.get_chronicled_wishes()
-
-    merge(
-        event_wishes,
-        coerce_chronicled_to_char_banner(chronicled_wishes, five_chars),
-        strategy=Strategy.ADDITIVE,
-    )
-    merge(
-        event_wishes,
-        coerce_chronicled_to_weap_banner(chronicled_wishes, five_weaps),
-        strategy=Strategy.ADDITIVE,
+    responses = fandom.fetch_all(
+        {
+            "five_chars": fandom.get_5_star_characters,
+            "four_chars": fandom.get_4_star_characters,
+            "five_weaps": fandom.get_5_star_weapons,
+            "four_weaps": fandom.get_4_star_weapons,
+            "event_wishes": fandom.get_event_wishes,
+            "chronicled_wishes": fandom.get_chronicled_wishes,
+        },
+        args.fetch_workers,
     )
+    five_chars = responses["five_chars"]
+    five_weaps = responses["five_weaps"]
+    event_wishes = responses["event_wishes"]
+    chronicled_wishes = responses["chronicled_wishes"]
+
+    # the chronicled wish pages are folded in as extra character and weapon banners
+    accumulator = fandom.QueryAccumulator(event_wishes)
+    accumulator.add(coerce_chronicled_to_char_banner(chronicled_wishes, five_chars))
+    accumulator.add(coerce_chronicled_to_weap_banner(chronicled_wishes, five_weaps))
 
-    data = banners.BannersParser().transform_data(
+    content_store = get_content_store(args, "genshin-impact")
+    histories = banners.BannersParser(
+        content_store=content_store, engine=args.engine, workers=args.workers
+    ).iter_transform_data(
         event_wishes,
         five_chars,
-        fandom.get_4_star_characters(),
+        responses["four_chars"],
         five_weaps,
-        fandom.get_4_star_weapons(),
+        responses["four_weaps"],
     )
 
-    write_data(args, data)
-    if not args.skip_images:
-        write_images(args, data)
-
-
-def write_images(args: argparse.Namespace, data: BannerDataset):
-    def get_generic_feature_type(feature_type: str) -> str:
-        if feature_type.lower().find("character") != -1:
-            return "characters"
-        return "weapons"
-
-    image_path = pathlib.Path(args.output_image_dir)
-    featured_type: str
-    banner_history_list: list[BannerHistory]
-    for featured_type, banner_history_list in data.items():
-        for bannerHistory in banner_history_list:
-            path = image_path.joinpath(
-                get_generic_feature_type(featured_type),
-                f"{samsara.generate.filename(bannerHistory['name'])}.png",
-            )
+    # images are queued as the data is written, but only downloaded once it has
+    # passed its size check, since nothing is done otherwise
+    downloads: list[tuple[str, BannerHistory]] = []
 
-            if args.force or not path.exists():
-                if get_generic_feature_type(featured_type) == "characters":
-                    fandom.download_character_image(path, bannerHistory["name"], 80)
-                else:
-                    fandom.download_weapon_image(path, bannerHistory["name"], 80)
-                time.sleep(0.5)  # Sleep 0.5 seconds between downloads
+    def on_history(featured_type: str, history: BannerHistory) -> None:
+        if not args.skip_images:
+            downloads.append((featured_type, history))
 
+    try:
+        write_data(args, histories, on_history)
+    finally:
+        if content_store is not None:
+            content_store.close()
 
-def write_data(args: argparse.Namespace, data: BannerDataset):
-    dump = yaml.dump(
-        data,
-        default_flow_style=False,
-        sort_keys=False,
-        Dumper=IndentedPropertyDumper,
+    for featured_type, history in downloads:
+        write_image(args, featured_type, history)
+
+
+def get_generic_feature_type(feature_type: str) -> str:
+    if feature_type.lower().find("character") != -1:
+        return "characters"
+    return "weapons"
+
+
+def write_image(args: argparse.Namespace, featured_type: str, history: BannerHistory):
+    path = pathlib.Path(args.output_image_dir).joinpath(
+        get_generic_feature_type(featured_type),
+        f"{samsara.generate.filename(history['name'])}.png",
     )
 
-    if len(dump) < args.min_data_size:
-        raise f"Banner data was under {args.min_data_size} (was {len(dump)}) -- aborting!"
+    if args.force or not path.exists():
+        if get_generic_feature_type(featured_type) == "characters":
+            fandom.download_character_image(path, history["name"], 80)
+        else:
+            fandom.download_weapon_image(path, history["name"], 80)
+        time.sleep(0.5)  # Sleep 0.5 seconds between downloads
+
+
+def write_data(
+    args: argparse.Namespace,
+    histories: Iterable[tuple[str, Iterable[BannerHistory]]],
+    on_history: Callable[[str, BannerHistory], None] | None = None,
+):
+    """
+    Writes each history as soon as it is computed, dumping one entry at a time in
+    the same layout as dumping the whole dataset. The output only replaces the
+    previous data once it is complete and at least min_data_size long.
+    """
+    size = 0
+    partial_output = args.output + ".tmp"
+    try:
+        with open(partial_output, "w") as f:
+            for featured_type, history_list in histories:
+                empty = True
+                for history in history_list:
+                    if empty:
+                        dump = f"{featured_type}:\n"
+                        empty = False
+                    else:
+                        dump = ""
+
+                    entry = yaml.dump(
+                        [history],
+                        default_flow_style=False,
+                        sort_keys=False,
+                        Dumper=IndentedPropertyDumper,
+                    )
+                    dump += "".join(f"  {line}" for line in entry.splitlines(True))
+                    f.write(dump)
+                    size += len(dump)
+
+                    if on_history is not None:
+                        on_history(featured_type, history)
+
+                if empty:
+                    dump = yaml.dump({featured_type: []}, Dumper=IndentedPropertyDumper)
+                    f.write(dump)
+                    size += len(dump)
+
+        if size < args.min_data_size:
+            raise Exception(
+                f"Banner data was under {args.min_data_size} (was {size})"
+                " -- aborting!"
+            )
 
-    with open(args.output, "w") as f:
-        f.write(dump)
+        os.replace(partial_output, args.output)
+    finally:
+        # left behind by an aborted or failed write
+        if os.path.exists(partial_output):
+            os.remove(partial_output)
 
 
 if __name__ == "__main__":
@@ -1,18 +1,34 @@
+import bisect
 import copy
+import functools
+import multiprocessing
 import re
-from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
 from packaging.version import Version
-from typing import TypedDict, TypeVar
+from typing import Iterable, Iterator, NamedTuple, TypedDict
 import logging
 
 from samsara import fandom
-from samsara.fandom import QueryResponse, Page
-
-T = TypeVar("T")
+from samsara.cache import LRUPageCache, PersistentPageCache
+from samsara.fandom import QueryResponse, Category, Page, Pages
 
 logger = logging.getLogger(__name__)
 
 
+# Roman numerals of the Luna versions, which follow 5.8
+LunaNumerals = {
+    "I": 1,
+    "II": 2,
+    "III": 3,
+    "IV": 4,
+    "V": 5,
+    "VI": 6,
+    "VII": 7,
+    "VIII": 8,
+}
+
+
 def parse_version_with_luna(version: str) -> tuple:
     """
     Parse version string, handling Luna versions as sequential versions after 5.8.
@@ -26,12 +42,7 @@ def parse_version_with_luna(version: str) -> tuple:
     luna_match = re.match(r'^Luna ([IVX]+)$', version)
     if luna_match:
         roman_numeral = luna_match.group(1)
-        # Convert Roman numerals to numbers
-        roman_to_int = {
-            'I': 1, 'II': 2, 'III': 3, 'IV': 4, 'V': 5, 
-            'VI': 6, 'VII': 7, 'VIII': 8
-        }
-        luna_number = roman_to_int.get(roman_numeral, 1)
+        luna_number = LunaNumerals.get(roman_numeral, 1)
         # Treat Luna I as 5.9, Luna II as 5.10, etc.
         synthetic_version = f"5.{8 + luna_number}"
         return tuple(int(x) for x in synthetic_version.split('.')) + (0,)
@@ -49,6 +60,42 @@ def parse_version_with_luna(version: str) -> tuple:
         return (999, 999, 999)
 
 
+class VersionCatalog:
+    """
+    Ranks version strings by parse_version_with_luna, parsing each distinct string
+    only once.
+
+    Every version gets a dense integer ordinal, so sorting by ordinal gives the same
+    order as sorting by the parsed tuple (unknown versions still sort last).
+
+    Only added versions have an ordinal: looking up any other version raises a
+    KeyError rather than adding it, which would renumber the ordinals callers
+    already hold.
+    """
+
+    def __init__(self) -> None:
+        self.keys: dict[str, tuple] = {}
+        self.ordinals: dict[str, int] = {}
+
+    def add(self, versions: Iterable[str]) -> None:
+        added = False
+        for version in versions:
+            if version not in self.keys:
+                self.keys[version] = parse_version_with_luna(version)
+                added = True
+
+        if not added:
+            return
+
+        ranks = {key: i for i, key in enumerate(sorted(set(self.keys.values())))}
+        self.ordinals = {version: ranks[key] for version, key in self.keys.items()}
+
+    def ordinal(self, version: str) -> int:
+        if version not in self.ordinals:
+            raise KeyError(f"Version {version} is not in the catalog")
+        return self.ordinals[version]
+
+
 class BannerDates(TypedDict):
     start: str
     end: str
@@ -67,68 +114,302 @@ class BannerDataset(TypedDict):
     fourStarWeapons: list[BannerHistory]
 
 
-def get_valid_date_or_blank(date: str) -> str:
+# day ordinal of banners without a valid date, which sorts after every real date
+InvalidDay = date.max.toordinal() + 1
+
+
+def parse_banner_day(banner_date: str) -> int:
     try:
-        datetime.strptime(date, "%Y-%m-%d")
-        return date
+        return datetime.strptime(banner_date, "%Y-%m-%d").toordinal()
     except BaseException:
+        return InvalidDay
+
+
+def format_banner_day(day: int) -> str:
+    if day == InvalidDay:
         return ""
+    return date.fromordinal(day).isoformat()
+
+
+class BannerTitle(NamedTuple):
+    # the part before the first "/"
+    name: str
+    # the breadcrumb right after the first "/", usually the banner start date
+    date: str
+    is_banner: bool
+    is_weapon: bool
+    # whether everything after the first "/" is a version like "3.6"
+    is_version: bool
+
+
+class TitleClassifier:
+    """
+    Splits a page title into a BannerTitle with a single precompiled match.
+    """
+
+    def __init__(self, weapon_pattern: str) -> None:
+        self.weapon_pattern = weapon_pattern
+        self.regex = re.compile(
+            rf"(?P<weapon>(?={weapon_pattern}))?(?P<name>[^/]*)"
+            r"(?:/(?P<breadcrumb>(?P<version>(?=\d+\.\d+$))?(?P<date>[^/]*).*))?",
+            re.DOTALL,
+        )
+
+    def classify(self, title: str) -> BannerTitle:
+        m = self.regex.match(title)
+        return BannerTitle(
+            name=m["name"],
+            date=m["date"] or "",
+            is_banner=m["breadcrumb"] is not None,
+            is_weapon=m["weapon"] is not None,
+            is_version=m["version"] is not None,
+        )
+
+
+# for the helpers that don't care which titles are weapon banners
+DefaultTitleClassifier = TitleClassifier(r"Epitome Invocation")
 
 
 def is_page_banner(page: Page) -> bool:
-    return page["title"].find("/") != -1
+    return DefaultTitleClassifier.classify(page["title"]).is_banner
 
 
 def get_banner_date(p: Page) -> str:
-    return p["title"].split("/")[1]
+    return DefaultTitleClassifier.classify(p["title"]).date
+
+
+class BannerPage:
+    """
+    The parts of an event wish page the parser needs, without the raw categories.
+    """
+
+    __slots__ = (
+        "pageid",
+        "name",
+        "date",
+        "day",
+        "is_weapon",
+        "version",
+        "featured_mask",
+    )
+
+    def __init__(
+        self,
+        pageid: int,
+        name: str,
+        date: str,
+        day: int,
+        is_weapon: bool,
+        version: str,
+        featured_mask: int,
+    ) -> None:
+        self.pageid = pageid
+        self.name = name
+        self.date = date
+        self.day = day
+        self.is_weapon = is_weapon
+        self.version = version
+        # bit i is set when the page features BannerIndex.featured_names[i]
+        self.featured_mask = featured_mask
+
+
+def get_revision_contents(qr: QueryResponse) -> dict[int, str]:
+    result: dict[int, str] = {}
+    for page in qr["query"]["pages"]:
+        # missing pages, and pages deferred to a continuation, have no revisions
+        if page.get("revisions"):
+            result[page["pageid"]] = page["revisions"][0]["slots"]["main"]["content"]
+
+    return result
+
+
+def get_last_revision_ids(qr: QueryResponse) -> dict[int, int]:
+    return {
+        page["pageid"]: page["lastrevid"]
+        for page in qr["query"]["pages"]
+        if "lastrevid" in page
+    }
 
 
-def append_unique(l: list[T], value: T):
-    if value not in l:
-        l.append(value)
+def iter_bits(mask: int) -> Iterator[int]:
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
 
 
-pagecache = {}
+# "columnar" computes the histories with NumPy (an optional dependency)
+Engines = ("python", "columnar")
+
+# shared by parsers that aren't given their own cache; keyed by (wiki, pageid)
+pagecache = LRUPageCache()
 
 
 class BannersParser:
-    def __init__(self) -> None:
+    Wiki = "genshin-impact"
+
+    def __init__(
+        self,
+        content_store: PersistentPageCache | None = None,
+        page_cache: LRUPageCache | None = None,
+        engine: str = "python",
+        workers: int = 1,
+    ) -> None:
+        if engine not in Engines:
+            raise ValueError(f"Unknown engine {engine}, expected one of {Engines}")
+
         self.CategoryVersionPrefix = "Category:Released in Version "
         self.CategoryFeaturedPrefix = "Category:Features "
         self.WeaponPagePrefix = r"Epitome Invocation"
+        self.title_classifier = DefaultTitleClassifier
         self.ChangeHistoryRegex = re.compile(r"\{\{Change History\|(\d+\.\d+)\}\}")
+        # pageid -> resolved version, cleared whenever a new index is built
+        self.version_cache: dict[int, str] = {}
+        self.version_cache_hits = 0
+        self.version_cache_misses = 0
+        # optional store of page contents that outlives the process
+        self.content_store = content_store
+        self.page_cache = page_cache if page_cache is not None else pagecache
+        # how histories are computed from the index, see Engines
+        self.engine = engine
+        # processes computing the categories of the python engine in parallel
+        self.workers = workers
+
+    def clear_version_cache(self) -> None:
+        self.version_cache = {}
+        self.version_cache_hits = 0
+        self.version_cache_misses = 0
 
     def cached_fetch_page_content(self, page_id: int) -> str:
-        if page_id in pagecache:
-            return pagecache[page_id]
-
         try:
-            pagecache[page_id] = self.fetch_page_content(page_id)
-        except BaseException:
-            pagecache[page_id] = ""
-
-        return pagecache[page_id]
+            return self.page_cache.get_or_fetch(
+                (self.Wiki, page_id), lambda: self.fetch_page_content(page_id)
+            )
+        except BaseException as e:
+            # failures are cached separately (and retried later) by the page cache
+            logger.info(f"Could not fetch page content for {page_id}: {e}")
+            return ""
 
     def fetch_page_content(self, page_id: int) -> str:
         return fandom.get_page_content(page_id)["query"]["pages"][0]["revisions"][0][
             "slots"
         ]["main"]["content"]
 
+    def fetch_pages_content(self, page_ids: list[int]) -> dict[int, str]:
+        return get_revision_contents(fandom.get_pages_content(page_ids))
+
+    def fetch_pages_revisions(self, page_ids: list[int]) -> dict[int, int]:
+        return get_last_revision_ids(fandom.get_pages_info(page_ids))
+
+    def load_stored_page_contents(
+        self, page_ids: list[int], revisions: dict[int, int]
+    ) -> list[int]:
+        """
+        Fills the page cache from the content store for every page whose stored
+        revision is still the latest one, recording the latest revisions as it goes.
+
+        Returns the pages that still have to be fetched.
+        """
+        result = []
+
+        for i in range(0, len(page_ids), fandom.MaxPageIds):
+            batch = page_ids[i : i + fandom.MaxPageIds]
+            try:
+                revisions.update(self.fetch_pages_revisions(batch))
+            except BaseException as e:
+                logger.info(f"Could not fetch page revisions for {batch}: {e}")
+                result.extend(batch)
+                continue
+
+            for page_id in batch:
+                content = (
+                    self.content_store.get(page_id, revisions[page_id])
+                    if page_id in revisions
+                    else None
+                )
+                if content is None:
+                    result.append(page_id)
+                else:
+                    self.page_cache.put((self.Wiki, page_id), content)
+
+        return result
+
+    def prefetch_page_contents(self, event_wishes_qr: QueryResponse) -> None:
+        """
+        Fetches the content of every banner page that needs the {{Change History}}
+        fallback in batches, so that version resolution does not make a request per
+        page.
+        """
+        # claimed in the page cache, so a concurrent parser waits for these pages
+        # instead of fetching them too
+        keys = self.page_cache.reserve(
+            (self.Wiki, p["pageid"])
+            for p in event_wishes_qr["query"]["pages"].values()
+            if is_page_banner(p) and self.needs_page_content(p)
+        )
+        try:
+            self.fetch_reserved_page_contents([page_id for _, page_id in keys])
+        finally:
+            # whatever was not fetched falls back to a single fetch
+            self.page_cache.release(keys)
+
+    def fetch_reserved_page_contents(self, page_ids: list[int]) -> None:
+        revisions: dict[int, int] = {}
+        if self.content_store is not None:
+            page_ids = self.load_stored_page_contents(page_ids, revisions)
+
+        for i in range(0, len(page_ids), fandom.MaxPageIds):
+            batch = page_ids[i : i + fandom.MaxPageIds]
+            try:
+                contents = self.fetch_pages_content(batch)
+            except BaseException as e:
+                # leave the batch uncached so each page falls back to a single fetch
+                logger.info(f"Could not fetch page contents for {batch}: {e}")
+                continue
+
+            for page_id in batch:
+                # a page missing from the reply is left to the single fetch fallback
+                if page_id not in contents:
+                    continue
+
+                self.page_cache.put((self.Wiki, page_id), contents[page_id])
+                if self.content_store is not None and page_id in revisions:
+                    self.content_store.put(
+                        page_id, revisions[page_id], contents[page_id]
+                    )
+
     def get_version_from_page(self, p: Page) -> str:
-        def get_last_breadcrump() -> str:
-            return p["title"][p["title"].find("/") + 1 :]
+        if p["pageid"] in self.version_cache:
+            self.version_cache_hits += 1
+            return self.version_cache[p["pageid"]]
 
-        def is_last_breadcrumb_a_version() -> bool:
-            return bool(re.match(r"^\d+\.\d+$", get_last_breadcrump()))
+        self.version_cache_misses += 1
+        version = self.resolve_version_from_page(p)
+        self.version_cache[p["pageid"]] = version
+        return version
 
-        versions = [
+    def get_version_categories(self, p: Page) -> list[Category]:
+        return [
             c
-            for c in p["categories"]
+            for c in p.get("categories", [])
             if c["title"].startswith(self.CategoryVersionPrefix)
         ]
 
-        if len(versions) != 1 and is_last_breadcrumb_a_version():
-            return get_last_breadcrump()
+    def needs_page_content(self, p: Page) -> bool:
+        """
+        Whether the version of a page can only be found in its {{Change History}}.
+        """
+        return (
+            len(self.get_version_categories(p)) == 0
+            and not self.classify_title(p["title"]).is_version
+        )
+
+    def resolve_version_from_page(self, p: Page) -> str:
+        versions = self.get_version_categories(p)
+
+        title = self.classify_title(p["title"])
+        if len(versions) != 1 and title.is_version:
+            return title.date
 
         if len(versions) == 0:
             content = self.cached_fetch_page_content(p["pageid"])
@@ -141,79 +422,57 @@ class BannersParser:
 
         return versions[0]["title"][len(self.CategoryVersionPrefix) :]
 
+    def classify_title(self, title: str) -> BannerTitle:
+        # compiled lazily, since subclasses may change WeaponPagePrefix after init
+        if self.title_classifier.weapon_pattern != self.WeaponPagePrefix:
+            self.title_classifier = TitleClassifier(self.WeaponPagePrefix)
+        return self.title_classifier.classify(title)
+
     def is_page_weapon(self, page: Page) -> bool:
-        return not not re.match(self.WeaponPagePrefix, page["title"])
-        # return page["title"].startswith(self.WeaponPagePrefix)
+        return self.classify_title(page["title"]).is_weapon
 
-    def page_contain_featured(self, p: Page, featured: str) -> bool:
-        return (
-            len(
-                [
-                    c
-                    for c in p["categories"]
-                    if c["title"] == f"{self.CategoryFeaturedPrefix}{featured}"
-                ]
-            )
-            > 0
+    def get_featured_names(self, p: Page) -> frozenset[str]:
+        return frozenset(
+            c["title"][len(self.CategoryFeaturedPrefix) :]
+            for c in p.get("categories", [])
+            if c["title"].startswith(self.CategoryFeaturedPrefix)
         )
 
     def get_pages_of_version(
         self,
-        event_wishes_qr: QueryResponse,
+        index: "BannerIndex",
         version: str,
         is_weapon: bool,
-    ) -> list[Page]:
-        def key_by_valid_date(p: Page) -> str:
-            return (
-                get_valid_date_or_blank(get_banner_date(p))
-                if get_valid_date_or_blank(get_banner_date(p)) != ""
-                else "9999-99-99"
-            )
-
-        return sorted(
-            [
-                p
-                for p in event_wishes_qr["query"]["pages"].values()
-                if is_page_banner(p)
-                and self.is_page_weapon(p) == is_weapon
-                and self.get_version_from_page(p) == version
-            ],
-            key=key_by_valid_date,
-        )
+    ) -> list[BannerPage]:
+        return index.pages_by_version.get((version, is_weapon), [])
 
     def get_minor_version(
         self,
-        event_wishes_qr: QueryResponse,
+        index: "BannerIndex",
         version: str,
-        featured: str,
+        date: str,
         is_weapon: bool,
     ) -> int:
-        result = 0
-        start_date = ""
-
-        for p in self.get_pages_of_version(event_wishes_qr, version, is_weapon):
-            if get_banner_date(p) != start_date:
-                start_date = get_banner_date(p)
-                result += 1
-
-            if self.page_contain_featured(p, featured):
-                break
-
-        return result
+        return index.phases[(version, is_weapon)][date]
 
     def filter_invalid_pages(
         self,
         event_wishes_qr: QueryResponse,
     ) -> QueryResponse:
-        result = copy.deepcopy(event_wishes_qr)
-        result["query"]["pages"] = {}
+        # shallow view over the response: the page dicts are shared, not copied,
+        # so callers must treat the result as read-only
+        pages: Pages = {}
+        result: QueryResponse = {
+            **event_wishes_qr,
+            "query": {**event_wishes_qr["query"], "pages": pages},
+        }
 
         for page in event_wishes_qr["query"]["pages"].values():
             if not is_page_banner(page):
                 continue
             try:
                 self.get_version_from_page(page)
-                result["query"]["pages"][page["pageid"]] = page
+                pages[page["pageid"]] = page
             except BaseException as e:
                 # Log or print the error message
                 logger.info(f"An error occurred: {e}")
@@ -221,120 +480,128 @@ class BannersParser:
 
         return result
 
+    def build_index(self, event_wishes_qr: QueryResponse) -> "BannerIndex":
+        self.clear_version_cache()
+        self.prefetch_page_contents(event_wishes_qr)
+        return BannerIndex(self, self.filter_invalid_pages(event_wishes_qr))
+
     def get_featured_versions(
         self,
-        event_wishes_qr: QueryResponse,
+        index: "BannerIndex",
         featured: str,
     ) -> list[str]:
-        result: list[str] = []
+        minor_versions: dict[tuple[str, bool], int] = {}
 
-        page: Page
-        for page in event_wishes_qr["query"]["pages"].values():
-            if self.page_contain_featured(page, featured):
-                append_unique(
-                    result,
-                    self.get_version_from_page(page)
-                    + "."
-                    + str(
-                        self.get_minor_version(
-                            event_wishes_qr,
-                            self.get_version_from_page(page),
-                            featured,
-                            self.is_page_weapon(page),
-                        )
-                    ),
-                )
-
-        result.sort(key=parse_version_with_luna)
+        for page in index.pages_by_featured.get(featured, []):
+            key = (page.version, page.is_weapon)
+            minor = self.get_minor_version(
+                index, page.version, page.date, page.is_weapon
+            )
+            # a version is only reported once, at the earliest phase featured
+            if key not in minor_versions or minor < minor_versions[key]:
+                minor_versions[key] = minor
+
+        # a dict is an insertion-ordered set: versions stay in order of appearance
+        result = list(
+            dict.fromkeys(
+                version + "." + str(minor)
+                for (version, _), minor in minor_versions.items()
+            )
+        )
+        result.sort(key=index.versions.ordinal)
         return result
 
     def get_next_banner_date(
         self,
-        event_wishes_qr: QueryResponse,
-        start_date: str,
+        index: "BannerIndex",
+        start_day: int,
         is_weapon: bool,
-    ) -> str:
-        result = sorted(
-            [
-                get_banner_date(p)
-                for p in event_wishes_qr["query"]["pages"].values()
-                if is_page_banner(p)
-                and self.is_page_weapon(p) == is_weapon
-                and get_banner_date(p) > start_date
-            ]
-        )
+    ) -> int:
+        days = index.days_by_kind.get(is_weapon, [])
+        i = bisect.bisect_right(days, start_day)
 
-        if len(result) > 0:
-            return result[0]
-        return ""
+        if i < len(days):
+            return days[i]
+        return InvalidDay
 
     def get_featured_dates(
         self,
-        event_wishes_qr: QueryResponse,
+        index: "BannerIndex",
         featured: str,
     ) -> list[BannerDates]:
-        result: list[BannerDates] = []
-
-        page: Page
-        for page in event_wishes_qr["query"]["pages"].values():
-            if self.page_contain_featured(page, featured):
-                append_unique(
-                    result,
-                    {
-                        "start": get_valid_date_or_blank(get_banner_date(page)),
-                        "end": get_valid_date_or_blank(
-                            self.get_next_banner_date(
-                                event_wishes_qr,
-                                get_banner_date(page),
-                                self.is_page_weapon(page),
-                            )
-                        )
-                        if get_valid_date_or_blank(get_banner_date(page)) != ""
-                        else "",
-                    },
-                )
-
-        def get_banner_start_date(b: BannerDates) -> str:
-            # empty start dates should go to the end
-            if b["start"] == "":
-                return "999999999"
-
-            return b["start"]
+        # (start, end) day ordinals, as an insertion-ordered set
+        result: dict[tuple[int, int], None] = {}
+
+        for page in index.pages_by_featured.get(featured, []):
+            end = (
+                self.get_next_banner_date(index, page.day, page.is_weapon)
+                if page.day != InvalidDay
+                else InvalidDay
+            )
+            result[(page.day, end)] = None
 
-        result.sort(key=get_banner_start_date)
-        return result
+        # banners without a start date go to the end
+        return [
+            {"start": format_banner_day(start), "end": format_banner_day(end)}
+            for start, end in sorted(result, key=lambda days: days[0])
+        ]
 
     def convert_specialization_page_to_title(self, p: Page) -> str:
-        if '/' in p['title']:
-            return p["title"].split("/")[0] + " (" + p["title"].split("/")[1] + ")"
+        title = self.classify_title(p["title"])
+        if title.is_banner:
+            return title.name + " (" + title.date + ")"
         else:
             return p["title"]
     
     def get_featured_banner_history(
         self,
-        event_wishes_qr: QueryResponse,
+        index: "BannerIndex",
         featured_qs: QueryResponse,
     ) -> list[BannerHistory]:
-        result: list[BannerHistory] = []
+        return list(self.iter_featured_banner_history(index, featured_qs))
+
+    def iter_featured_banner_history(
+        self,
+        index: "BannerIndex",
+        featured_qs: QueryResponse,
+    ) -> Iterator[BannerHistory]:
+        """
+        Yields the featured histories in their final order, computing each one only
+        when it is reached.
+
+        The order only needs each item's earliest version, which is the smallest
+        ordinal of its pages' "version.phase" (a later phase never sorts earlier).
+        """
+        featured: list[tuple[int, str]] = []
         page: Page
         for page in featured_qs["query"]["pages"].values():
             page['title'] = self.convert_specialization_page_to_title(page)
-            
-            result.append(
-                {
-                    "name": page["title"],
-                    "versions": self.get_featured_versions(
-                        event_wishes_qr, page["title"]
-                    ),
-                    "dates": self.get_featured_dates(event_wishes_qr, page["title"]),
-                }
+
+            # most category members (especially 4-star weapons) were never featured
+            if page["title"] not in index.pages_by_featured:
+                continue
+
+            ordinal = min(
+                index.versions.ordinal(
+                    f"{p.version}."
+                    f"{self.get_minor_version(index, p.version, p.date, p.is_weapon)}"
+                )
+                for p in index.pages_by_featured[page["title"]]
             )
-            assert len(result[-1]["versions"]) == len(result[-1]["dates"])
+            featured.append((ordinal, page["title"]))
 
-        return sorted(
-            [r for r in result if len(r["versions"]) > 0],
-            key=lambda f: parse_version_with_luna(f["versions"][0]),
-        )
+        featured.sort(key=lambda f: f[0])
+        for _, name in featured:
+            yield self.get_featured_history(index, name)
+
+    def get_featured_history(self, index: "BannerIndex", name: str) -> BannerHistory:
+        history: BannerHistory = {
+            "name": name,
+            "versions": self.get_featured_versions(index, name),
+            "dates": self.get_featured_dates(index, name),
+        }
+        assert len(history["versions"]) == len(history["dates"])
+        return history
 
     def transform_data(
         self,
@@ -344,24 +611,514 @@ class BannersParser:
         five_star_weapons_qr: QueryResponse,
         four_star_weapons_qr: QueryResponse,
     ) -> BannerDataset:
-        return {
-            "fiveStarCharacters": self.get_featured_banner_history(
-                self.filter_invalid_pages(event_wishes_qr),
-                five_star_characters_qr,
-            ),
-            "fourStarCharacters": self.get_featured_banner_history(
-                self.filter_invalid_pages(event_wishes_qr),
-                four_star_characters_qr,
-            ),
-            "fiveStarWeapons": self.get_featured_banner_history(
-                self.filter_invalid_pages(event_wishes_qr),
-                five_star_weapons_qr,
-            ),
-            "fourStarWeapons": self.get_featured_banner_history(
-                self.filter_invalid_pages(event_wishes_qr),
-                four_star_weapons_qr,
-            ),
-        }
+        return self.transform_categories(
+            event_wishes_qr,
+            {
+                "fiveStarCharacters": five_star_characters_qr,
+                "fourStarCharacters": four_star_characters_qr,
+                "fiveStarWeapons": five_star_weapons_qr,
+                "fourStarWeapons": four_star_weapons_qr,
+            },
+        )
+
+    def iter_transform_data(
+        self,
+        event_wishes_qr: QueryResponse,
+        five_star_characters_qr: QueryResponse,
+        four_star_characters_qr: QueryResponse,
+        five_star_weapons_qr: QueryResponse,
+        four_star_weapons_qr: QueryResponse,
+    ) -> Iterator[tuple[str, Iterator[BannerHistory]]]:
+        return self.iter_transform_categories(
+            event_wishes_qr,
+            {
+                "fiveStarCharacters": five_star_characters_qr,
+                "fourStarCharacters": four_star_characters_qr,
+                "fiveStarWeapons": five_star_weapons_qr,
+                "fourStarWeapons": four_star_weapons_qr,
+            },
+        )
+
+    def transform_categories(
+        self,
+        event_wishes_qr: QueryResponse,
+        categories: dict[str, QueryResponse],
+    ) -> dict[str, list[BannerHistory]]:
+        """
+        Computes the banner history of every category of featured items against the
+        same index, in worker processes when the parser has more than one worker.
+        """
+        index = self.build_index(event_wishes_qr)
+
+        if self.engine == "columnar":
+            get_history = ColumnarBannerTable(self, index).get_featured_banner_history
+        elif self.workers > 1 and len(categories) > 1:
+            return self.transform_categories_in_parallel(index, categories)
+        else:
+            get_history = functools.partial(self.get_featured_banner_history, index)
+
+        return {name: get_history(qr) for name, qr in categories.items()}
+
+    def iter_transform_categories(
+        self,
+        event_wishes_qr: QueryResponse,
+        categories: dict[str, QueryResponse],
+    ) -> Iterator[tuple[str, Iterator[BannerHistory]]]:
+        """
+        Streaming form of transform_categories: yields each category name with an
+        iterator of its histories, computed as they are consumed. The columnar and
+        parallel modes compute everything up front and then yield it.
+        """
+        if self.engine == "columnar" or (self.workers > 1 and len(categories) > 1):
+            for name, histories in self.transform_categories(
+                event_wishes_qr, categories
+            ).items():
+                yield name, iter(histories)
+            return
+
+        index = self.build_index(event_wishes_qr)
+        for name, qr in categories.items():
+            yield name, self.iter_featured_banner_history(index, qr)
+
+    def patch_data(
+        self,
+        previous: BannerDataset,
+        changed_pages: Iterable[Page],
+        event_wishes_qr: QueryResponse,
+        five_star_characters_qr: QueryResponse,
+        four_star_characters_qr: QueryResponse,
+        five_star_weapons_qr: QueryResponse,
+        four_star_weapons_qr: QueryResponse,
+        verify: bool = False,
+    ) -> BannerDataset:
+        return self.patch_categories(
+            previous,
+            changed_pages,
+            event_wishes_qr,
+            {
+                "fiveStarCharacters": five_star_characters_qr,
+                "fourStarCharacters": four_star_characters_qr,
+                "fiveStarWeapons": five_star_weapons_qr,
+                "fourStarWeapons": four_star_weapons_qr,
+            },
+            verify,
+        )
+
+    def patch_categories(
+        self,
+        previous: dict[str, list[BannerHistory]],
+        changed_pages: Iterable[Page],
+        event_wishes_qr: QueryResponse,
+        categories: dict[str, QueryResponse],
+        verify: bool = False,
+    ) -> dict[str, list[BannerHistory]]:
+        """
+        Brings the histories of a previous transform up to date, recomputing only
+        the histories affected by changed_pages: the banner pages added, changed or
+        removed since then (see get_changed_pages). Every other history is reused
+        as is, and only the order of each category is recomputed.
+
+        With verify, the result is checked against a full recompute.
+        """
+        index = self.build_index(event_wishes_qr)
+        affected = self.get_affected_names(index, changed_pages)
+
+        result = {}
+        for name, qr in categories.items():
+            reusable = {h["name"]: h for h in previous.get(name, [])}
+            histories: list[BannerHistory] = []
+
+            page: Page
+            for page in qr["query"]["pages"].values():
+                page["title"] = self.convert_specialization_page_to_title(page)
+                featured = page["title"]
+
+                if featured not in index.pages_by_featured:
+                    continue
+
+                if featured in affected or featured not in reusable:
+                    histories.append(self.get_featured_history(index, featured))
+                else:
+                    histories.append(reusable[featured])
+
+            # the earliest version comes first, and is the one the histories sort by
+            histories.sort(key=lambda h: index.versions.ordinal(h["versions"][0]))
+            result[name] = histories
+
+        if verify:
+            for name, qr in categories.items():
+                if result[name] != self.get_featured_banner_history(index, qr):
+                    raise Exception(f"Patched {name} differ from a full recompute")
+
+        return result
+
+    def get_affected_names(
+        self, index: "BannerIndex", changed_pages: Iterable[Page]
+    ) -> set[str]:
+        """
+        The featured names whose history may differ because of changed_pages: the
+        ones featured on them, on the banners just before them (whose end date is
+        their start date) and on the banners of their version (whose phases shift).
+        """
+        affected: set[str] = set()
+
+        for p in changed_pages:
+            title = self.classify_title(p["title"])
+            if not title.is_banner:
+                continue
+
+            affected.update(self.get_featured_names(p))
+
+            day = parse_banner_day(title.date)
+            days = index.days_by_kind.get(title.is_weapon, [])
+            i = bisect.bisect_left(days, day)
+            if day != InvalidDay and i > 0:
+                for page in index.pages:
+                    if page.is_weapon == title.is_weapon and page.day == days[i - 1]:
+                        affected.update(index.names_of(page.featured_mask))
+
+            try:
+                # not cached: the page may be the removed or previous revision
+                version = self.resolve_version_from_page(p)
+            except BaseException:
+                # never indexed, so it cannot have shifted any phase
+                continue
+
+            for page in self.get_pages_of_version(index, version, title.is_weapon):
+                affected.update(index.names_of(page.featured_mask))
+
+        return affected
+
+    def transform_categories_in_parallel(
+        self,
+        index: "BannerIndex",
+        categories: dict[str, QueryResponse],
+    ) -> dict[str, list[BannerHistory]]:
+        # forked workers inherit the parser and index without pickling them, other
+        # start methods get a pickled index and a fresh parser of the same class
+        if "fork" in multiprocessing.get_all_start_methods():
+            context = multiprocessing.get_context("fork")
+            parser = self
+        else:
+            context = multiprocessing.get_context("spawn")
+            parser = type(self)
+
+        with ProcessPoolExecutor(
+            max_workers=min(self.workers, len(categories)),
+            mp_context=context,
+            initializer=init_history_worker,
+            initargs=(parser, index),
+        ) as executor:
+            futures = {
+                name: executor.submit(get_history_in_worker, qr)
+                for name, qr in categories.items()
+            }
+            return {name: future.result() for name, future in futures.items()}
+
+
+# the parser and index of a worker process, set up by init_history_worker
+worker_state: tuple["BannersParser", "BannerIndex"] | None = None
+
+
+def init_history_worker(
+    parser: BannersParser | type[BannersParser], index: "BannerIndex"
+) -> None:
+    global worker_state
+    worker_state = (parser if isinstance(parser, BannersParser) else parser(), index)
+
+
+def get_history_in_worker(featured_qs: QueryResponse) -> list[BannerHistory]:
+    parser, index = worker_state
+    return parser.get_featured_banner_history(index, featured_qs)
+
+
+class BannerIndex:
+    """
+    Parsed view of the (already filtered) event wishes, built once per transform.
+
+    Every page is parsed exactly once; the parser's query methods read from the
+    lists below instead of re-scanning the raw query response.
+
+    Featured names get integer ids, so sets of names and sets of pages are kept as
+    int bitmasks (over the ids and over the positions in self.pages), which the
+    query methods at the bottom combine with bitwise operations.
+    """
+
+    def __init__(self, parser: BannersParser, event_wishes_qr: QueryResponse) -> None:
+        self.pages: list[BannerPage] = []
+        self.pages_by_version: dict[tuple[str, bool], list[BannerPage]] = {}
+        # featured name -> pages featuring it, in query order
+        self.pages_by_featured: dict[str, list[BannerPage]] = {}
+        # featured name <-> id, and per id the mask of the pages featuring it
+        self.featured_ids: dict[str, int] = {}
+        self.featured_names: list[str] = []
+        self.featured_pages: list[int] = []
+        # version -> mask of its pages, of either kind
+        self.version_pages: dict[str, int] = {}
+        # is_weapon -> sorted valid banner day ordinals, searched with bisect
+        self.days_by_kind: dict[bool, list[int]] = {}
+        # (version, is_weapon) -> banner date -> phase number within the version
+        self.phases: dict[tuple[str, bool], dict[str, int]] = {}
+        # every "version.phase" that can be reported
+        self.versions = VersionCatalog()
+
+        for p in event_wishes_qr["query"]["pages"].values():
+            title = parser.classify_title(p["title"])
+            if not title.is_banner:
+                continue
+
+            row = 1 << len(self.pages)
+            featured = sorted(parser.get_featured_names(p))
+            page = BannerPage(
+                pageid=p["pageid"],
+                name=title.name,
+                date=title.date,
+                day=parse_banner_day(title.date),
+                is_weapon=title.is_weapon,
+                version=parser.get_version_from_page(p),
+                featured_mask=self.add_featured(featured, row),
+            )
+            self.pages.append(page)
+            self.version_pages[page.version] = (
+                self.version_pages.get(page.version, 0) | row
+            )
+            self.pages_by_version.setdefault((page.version, page.is_weapon), []).append(
+                page
+            )
+            if page.day != InvalidDay:
+                self.days_by_kind.setdefault(page.is_weapon, []).append(page.day)
+            for name in featured:
+                self.pages_by_featured.setdefault(name, []).append(page)
+
+        for key, pages in self.pages_by_version.items():
+            pages.sort(key=lambda p: p.day)
+
+            phases = self.phases[key] = {}
+            phase = 0
+            start_date = ""
+            for page in pages:
+                if page.date != start_date:
+                    start_date = page.date
+                    phase += 1
+                phases.setdefault(page.date, phase)
+
+        self.versions.add(
+            f"{version}.{phase}"
+            for (version, _), phases in self.phases.items()
+            for phase in phases.values()
+        )
+        for days in self.days_by_kind.values():
+            days.sort()
+
+    def add_featured(self, names: list[str], row: int) -> int:
+        mask = 0
+        for name in names:
+            if name not in self.featured_ids:
+                self.featured_ids[name] = len(self.featured_names)
+                self.featured_names.append(name)
+                self.featured_pages.append(0)
+
+            featured_id = self.featured_ids[name]
+            self.featured_pages[featured_id] |= row
+            mask |= 1 << featured_id
+
+        return mask
+
+    def featured_mask(self, names: Iterable[str]) -> int:
+        mask = 0
+        for name in names:
+            if name in self.featured_ids:
+                mask |= 1 << self.featured_ids[name]
+        return mask
+
+    def names_of(self, mask: int) -> list[str]:
+        return [self.featured_names[i] for i in iter_bits(mask)]
+
+    def pages_of(self, mask: int) -> list[BannerPage]:
+        return [self.pages[i] for i in iter_bits(mask)]
+
+    def page_mask(self, names: Iterable[str]) -> int:
+        """
+        The pages featuring any of names.
+        """
+        mask = 0
+        for name in names:
+            if name in self.featured_ids:
+                mask |= self.featured_pages[self.featured_ids[name]]
+        return mask
+
+    def pages_featuring(self, name: str) -> list[BannerPage]:
+        return self.pages_of(self.page_mask([name]))
+
+    def featured_with(self, name: str, among: Iterable[str] | None = None) -> list[str]:
+        """
+        The names that shared a banner with name, optionally limited to among (for
+        example the 4-star characters that were on a 5-star character's banners).
+        """
+        mask = 0
+        for page in self.pages_featuring(name):
+            mask |= page.featured_mask
+        mask &= ~self.featured_mask([name])
+        if among is not None:
+            mask &= self.featured_mask(among)
+
+        return self.names_of(mask)
+
+    def pages_in_version(
+        self, version: str, featuring: Iterable[str] | None = None
+    ) -> list[BannerPage]:
+        mask = self.version_pages.get(version, 0)
+        if featuring is not None:
+            mask &= self.page_mask(featuring)
+
+        return self.pages_of(mask)
+
+
+class ColumnarBannerTable:
+    """
+    Columnar form of a BannerIndex that computes the history of every featured item
+    at once with NumPy group-bys, instead of looping over each item's pages.
+
+    The histories are identical to BannersParser.get_featured_banner_history.
+    """
+
+    def __init__(self, parser: BannersParser, index: BannerIndex) -> None:
+        try:
+            import numpy as np
+        except ImportError as e:
+            raise ImportError("The columnar engine requires numpy") from e
+
+        self.parser = parser
+        # name -> (versions, (start, end) dates, ordinal of the earliest version)
+        self.histories: dict[str, tuple[list[str], list[tuple[str, str]], int]] = {}
+
+        pages = index.pages
+        version_names = list(dict.fromkeys(p.version for p in pages))
+        version_codes = {version: i for i, version in enumerate(version_names)}
+        names = index.featured_names
+
+        # one row per page
+        day = np.array([p.day for p in pages], dtype=np.int64)
+        kind = np.array([p.is_weapon for p in pages], dtype=np.int64)
+        version = np.array([version_codes[p.version] for p in pages], dtype=np.int64)
+        phase = np.array(
+            [index.phases[(p.version, p.is_weapon)][p.date] for p in pages],
+            dtype=np.int64,
+        )
+        end = np.full(len(pages), InvalidDay, dtype=np.int64)
+        for is_weapon, days in index.days_by_kind.items():
+            days = np.asarray(days, dtype=np.int64)
+            rows = np.flatnonzero((kind == is_weapon) & (day != InvalidDay))
+            i = np.searchsorted(days, day[rows], side="right")
+            found = i < len(days)
+            end[rows[found]] = days[i[found]]
+
+        # sparse page x featured item incidence, in coordinate form
+        entry_row = np.array(
+            [row for row, p in enumerate(pages) for _ in iter_bits(p.featured_mask)],
+            dtype=np.int64,
+        )
+        entry_item = np.array(
+            [i for p in pages for i in iter_bits(p.featured_mask)], dtype=np.int64
+        )
+        if len(entry_row) == 0:
+            return
+
+        # item-major, keeping query order within each item
+        order = np.lexsort((entry_row, entry_item))
+        item = entry_item[order]
+        row = entry_row[order]
+
+        # earliest phase featured per (item, version, kind)
+        groups, group_first, group_of = np.unique(
+            np.stack([item, version[row], kind[row]], axis=1),
+            axis=0,
+            return_index=True,
+            return_inverse=True,
+        )
+        min_phase = np.full(len(groups), np.iinfo(np.int64).max, dtype=np.int64)
+        np.minimum.at(min_phase, group_of.reshape(-1), phase[row])
+
+        # unique "version.phase" per item, at its first appearance
+        reported, reported_of = np.unique(
+            np.stack([groups[:, 0], groups[:, 1], min_phase], axis=1),
+            axis=0,
+            return_inverse=True,
+        )
+        first = np.full(len(reported), len(item), dtype=np.int64)
+        np.minimum.at(first, reported_of.reshape(-1), group_first)
+
+        pairs, pair_of = np.unique(reported[:, 1:], axis=0, return_inverse=True)
+        pair_of = pair_of.reshape(-1)
+        pair_names = [f"{version_names[v]}.{minor}" for v, minor in pairs.tolist()]
+        pair_ordinals = np.array(
+            [index.versions.ordinal(name) for name in pair_names], dtype=np.int64
+        )
+        ordinal = pair_ordinals[pair_of]
+        order = np.lexsort((first, ordinal, reported[:, 0]))
+        version_items = reported[order, 0]
+        version_pairs = pair_of[order].tolist()
+        version_ordinals = ordinal[order]
+
+        # unique (start, end) per item, at its first appearance, ordered by start
+        dates, date_first = np.unique(
+            np.stack([item, day[row], end[row]], axis=1), axis=0, return_index=True
+        )
+        order = np.lexsort((date_first, dates[:, 1], dates[:, 0]))
+        dates = dates[order]
+        day_names = {d: format_banner_day(d) for d in np.unique(dates[:, 1:]).tolist()}
+
+        version_bounds = np.searchsorted(version_items, np.arange(len(names) + 1))
+        date_bounds = np.searchsorted(dates[:, 0], np.arange(len(names) + 1))
+        for i, name in enumerate(names):
+            v_start, v_stop = version_bounds[i], version_bounds[i + 1]
+            d_start, d_stop = date_bounds[i], date_bounds[i + 1]
+            self.histories[name] = (
+                [pair_names[k] for k in version_pairs[v_start:v_stop]],
+                [
+                    (day_names[start], day_names[stop])
+                    for start, stop in dates[d_start:d_stop, 1:].tolist()
+                ],
+                int(version_ordinals[v_start]),
+            )
+
+    def get_featured_banner_history(
+        self,
+        featured_qs: QueryResponse,
+    ) -> list[BannerHistory]:
+        result: list[BannerHistory] = []
+        page: Page
+        for page in featured_qs["query"]["pages"].values():
+            page["title"] = self.parser.convert_specialization_page_to_title(page)
+
+            if page["title"] not in self.histories:
+                continue
+
+            versions, dates, _ = self.histories[page["title"]]
+            # fresh lists for every entry, so a YAML dump never emits aliases
+            result.append(
+                {
+                    "name": page["title"],
+                    "versions": list(versions),
+                    "dates": [{"start": start, "end": end} for start, end in dates],
+                }
+            )
+            assert len(result[-1]["versions"]) == len(result[-1]["dates"])
+
+        return sorted(result, key=lambda f: self.histories[f["name"]][2])
+
+
+def get_changed_pages(previous_qr: QueryResponse, qr: QueryResponse) -> list[Page]:
+    """
+    The pages added, removed or changed between two queries of the same category.
+    Both sides of a changed page are included.
+    """
+    previous_pages = {p["pageid"]: p for p in previous_qr["query"]["pages"].values()}
+    pages = {p["pageid"]: p for p in qr["query"]["pages"].values()}
+
+    result = [p for page_id, p in pages.items() if previous_pages.get(page_id) != p]
+    result.extend(p for page_id, p in previous_pages.items() if pages.get(page_id) != p)
+    return result
 
 
 def get_qr_page_titles(qr: QueryResponse, category: str) -> list[str]:
@@ -412,9 +1169,8 @@ def coerce_chronicled_to_weap_banner(
         # weap banner can be differentiated by negative page id...
         result["query"]["pages"][-page["pageid"]] = copy.deepcopy(page)
         result["query"]["pages"][-page["pageid"]]["pageid"] = -page["pageid"]
-        result["query"]["pages"][-page["pageid"]]["title"] = (
-            "Epitome Invocation/" + page["title"].split("/")[1]
-        )
+        title = "Epitome Invocation/" + get_banner_date(page)
+        result["query"]["pages"][-page["pageid"]]["title"] = title
         result["query"]["pages"][-page["pageid"]]["categories"].extend(
             [
                 {"title": "Category:Features " + strip_chronicled_prefix(c["title"])}
@@ -0,0 +1,273 @@
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from concurrent.futures import Future
+from pathlib import Path
+from typing import Callable, Hashable, Iterable
+
+# a week is long enough to survive between scheduled runs
+DefaultMaxAge = 7 * 24 * 60 * 60
+DefaultMaxEntries = 10000
+
+# the in-memory cache only has to hold the versionless banner pages of a few wikis
+DefaultMaxMemoryEntries = 1024
+
+# failed fetches are retried after a minute, and after 3 attempts only once an hour
+DefaultFailureTTL = 60
+DefaultMaxRetries = 3
+DefaultBackoffTTL = 60 * 60
+
+
+class PageFetchFailed(Exception):
+    pass
+
+
+class FailedFetch:
+    __slots__ = ("attempts", "expires_at")
+
+    def __init__(self, attempts: int, expires_at: float) -> None:
+        self.attempts = attempts
+        self.expires_at = expires_at
+
+
+class LRUPageCache:
+    """
+    Bounded, thread-safe in-memory cache of page contents.
+
+    Concurrent get_or_fetch calls for the same key share a single fetch, and the
+    least recently used entry is evicted once max_entries is reached. A batch
+    fetch claims its keys with reserve, so that get_or_fetch and other reserve
+    calls wait for its put (or release) instead of fetching the same keys again.
+
+    A failed fetch is remembered as a negative entry: get_or_fetch raises
+    PageFetchFailed for failure_ttl seconds instead of fetching again, or for
+    backoff_ttl seconds once max_retries attempts in a row have failed.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = DefaultMaxMemoryEntries,
+        failure_ttl: float = DefaultFailureTTL,
+        max_retries: int = DefaultMaxRetries,
+        backoff_ttl: float = DefaultBackoffTTL,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.max_entries = max_entries
+        self.failure_ttl = failure_ttl
+        self.max_retries = max_retries
+        self.backoff_ttl = backoff_ttl
+        self.clock = clock
+        self.entries: OrderedDict[Hashable, str] = OrderedDict()
+        self.failures: OrderedDict[Hashable, FailedFetch] = OrderedDict()
+        self.pending: dict[Hashable, Future] = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.negative_hits = 0
+
+    def get(self, key: Hashable) -> str | None:
+        with self.lock:
+            if key not in self.entries:
+                self.misses += 1
+                return None
+
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return self.entries[key]
+
+    def put(self, key: Hashable, value: str) -> None:
+        with self.lock:
+            self._put(key, value)
+            self.failures.pop(key, None)
+            future = self.pending.pop(key, None)
+        if future is not None:
+            future.set_result(value)
+
+    def reserve(self, keys: Iterable[Hashable]) -> list[Hashable]:
+        """
+        Claims the keys that are not cached, failing or already being fetched, and
+        returns them. The caller must put or release every key it claimed.
+        """
+        result = []
+        with self.lock:
+            for key in keys:
+                if key in self.entries or key in self.pending or self._is_failing(key):
+                    continue
+                self.misses += 1
+                self.pending[key] = Future()
+                result.append(key)
+        return result
+
+    def release(self, keys: Iterable[Hashable]) -> None:
+        """
+        Gives up the claim on keys that were not put, so their waiters fetch them.
+        """
+        with self.lock:
+            futures = [self.pending.pop(key) for key in keys if key in self.pending]
+        for future in futures:
+            future.set_result(None)
+
+    def _put(self, key: Hashable, value: str) -> None:
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def _is_failing(self, key: Hashable) -> bool:
+        failure = self.failures.get(key)
+        return failure is not None and failure.expires_at > self.clock()
+
+    def is_failing(self, key: Hashable) -> bool:
+        with self.lock:
+            return self._is_failing(key)
+
+    def _record_failure(self, key: Hashable) -> None:
+        failure = self.failures.pop(key, None)
+        attempts = failure.attempts + 1 if failure is not None else 1
+        ttl = self.failure_ttl if attempts < self.max_retries else self.backoff_ttl
+        self.failures[key] = FailedFetch(attempts, self.clock() + ttl)
+        while len(self.failures) > self.max_entries:
+            self.failures.popitem(last=False)
+
+    def get_or_fetch(self, key: Hashable, fetch: Callable[[], str]) -> str:
+        with self.lock:
+            if key in self.entries:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return self.entries[key]
+
+            if self._is_failing(key):
+                self.negative_hits += 1
+                raise PageFetchFailed(f"Fetching {key} failed recently")
+
+            future = self.pending.get(key)
+            owner = future is None
+            if owner:
+                self.misses += 1
+                future = self.pending[key] = Future()
+
+        if not owner:
+            value = future.result()
+            # a released reservation was never fetched
+            if value is None:
+                return self.get_or_fetch(key, fetch)
+            return value
+
+        try:
+            value = fetch()
+        except BaseException as e:
+            with self.lock:
+                self._record_failure(key)
+                self.pending.pop(key, None)
+            if not future.done():
+                future.set_exception(e)
+            raise
+
+        with self.lock:
+            self._put(key, value)
+            self.failures.pop(key, None)
+            self.pending.pop(key, None)
+        if not future.done():
+            future.set_result(value)
+        return value
+
+    def clear(self) -> None:
+        with self.lock:
+            self.entries.clear()
+            self.failures.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        with self.lock:
+            return key in self.entries
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+
+class PersistentPageCache:
+    """
+    SQLite backed store of page contents that survives between runs.
+
+    Entries are keyed by wiki + pageid and only returned for the revision they were
+    stored under, so a page edited on the wiki is fetched again. Entries unused for
+    longer than max_age seconds, and the least recently used entries beyond
+    max_entries, are evicted whenever the store is opened or closed.
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        wiki: str,
+        max_entries: int = DefaultMaxEntries,
+        max_age: float = DefaultMaxAge,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        self.wiki = wiki
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.clock = clock
+        self.connection = sqlite3.connect(path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS pages ("
+            " wiki TEXT NOT NULL,"
+            " pageid INTEGER NOT NULL,"
+            " revid INTEGER NOT NULL,"
+            " content BLOB NOT NULL,"
+            " used_at REAL NOT NULL,"
+            " PRIMARY KEY (wiki, pageid))"
+        )
+        self.evict()
+
+    def get(self, page_id: int, revision_id: int) -> str | None:
+        row = self.connection.execute(
+            "SELECT content FROM pages WHERE wiki = ? AND pageid = ? AND revid = ?",
+            (self.wiki, page_id, revision_id),
+        ).fetchone()
+
+        if row is None:
+            return None
+
+        with self.connection:
+            self.connection.execute(
+                "UPDATE pages SET used_at = ? WHERE wiki = ? AND pageid = ?",
+                (self.clock(), self.wiki, page_id),
+            )
+        return zlib.decompress(row[0]).decode("utf-8")
+
+    def put(self, page_id: int, revision_id: int, content: str) -> None:
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO pages VALUES (?, ?, ?, ?, ?)",
+                (
+                    self.wiki,
+                    page_id,
+                    revision_id,
+                    zlib.compress(content.encode("utf-8")),
+                    self.clock(),
+                ),
+            )
+
+    def evict(self) -> None:
+        with self.connection:
+            self.connection.execute(
+                "DELETE FROM pages WHERE used_at < ?",
+                (self.clock() - self.max_age,),
+            )
+            self.connection.execute(
+                "DELETE FROM pages WHERE rowid NOT IN"
+                " (SELECT rowid FROM pages ORDER BY used_at DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+
+    def __len__(self) -> int:
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM pages WHERE wiki = ?", (self.wiki,)
+        ).fetchone()[0]
+
+    def close(self) -> None:
+        self.evict()
+        self.connection.close()
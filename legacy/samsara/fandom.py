@@ -1,20 +1,58 @@
+import asyncio
+import contextlib
 import logging
 import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import TypedDict, NotRequired
+from typing import (
+    TYPE_CHECKING,
+    Any,
+    AsyncIterator,
+    Callable,
+    Iterable,
+    TypedDict,
+    NotRequired,
+)
+from urllib.parse import urlparse
 
 import requests as requests
-from mergedeep import merge, Strategy
+from requests.adapters import HTTPAdapter
+
+from samsara.jsonstream import JsonStream
+
+if TYPE_CHECKING:
+    import aiohttp
 
 # seems like 1-2 pages a year, so this should be more than enough
 MaxContinues = 100
 
+# the most pageids MediaWiki accepts in one request
+MaxPageIds = 50
+
+Wiki = "genshin-impact"
+
+# kept-alive connections per wiki: the queries plus the image downloader
+DefaultPoolSize = 10
+DefaultHeaders = {"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"}
+
+# whether query_all decodes responses as they arrive instead of all at once
+StreamResponses = False
+StreamChunkSize = 64 * 1024
+
+# fields of a response that nothing reads, discarded while streaming it
+DiscardedFields = frozenset({"ns", "limits"})
+
+# category queries fetched at once, below the pool size so downloads get a connection
+DefaultFetchWorkers = 6
+
 Continuable = TypedDict(
     "Continuable",
     {
         "continue": NotRequired[str],
         "clcontinue": NotRequired[str],
         "gcmcontinue": NotRequired[str],
+        "rvcontinue": NotRequired[str],
     },
 )
 
@@ -48,38 +86,327 @@ QueryResponse = TypedDict(
 )
 
 
+class QueryAccumulator:
+    """
+    Folds the pages of a paginated query (or several queries of the same shape)
+    into one QueryResponse in linear time.
+
+    Pages are found by their key (their pageid in formatversion 2 lists), and the
+    lists of a page seen again, such as its categories, are appended to, so data
+    already merged is never walked again. Continuation metadata is dropped.
+    """
+
+    def __init__(self, result: QueryResponse | None = None) -> None:
+        self.result: QueryResponse = QueryResponse() if result is None else result
+        self.pages: dict[int | str, Page] = {}
+
+        pages = self.result.get("query", {}).get("pages")
+        if isinstance(pages, dict):
+            self.pages.update(pages)
+        elif isinstance(pages, list):
+            self.pages.update((self.page_key(page), page) for page in pages)
+
+    @staticmethod
+    def page_key(page: Page) -> int | str:
+        # pages with an invalid title have no pageid
+        return page.get("pageid", page.get("title"))
+
+    def add(self, response: QueryResponse) -> None:
+        for key, value in response.items():
+            if key == "continue":
+                continue
+            if key == "query":
+                self.add_query(value)
+            else:
+                self.result[key] = value
+
+    def add_query(self, query: Query) -> None:
+        result = self.result.setdefault("query", {})
+        for key, value in query.items():
+            if key == "pages":
+                self.add_pages(value)
+            elif isinstance(value, list) and isinstance(result.get(key), list):
+                result[key].extend(value)
+            else:
+                result[key] = value
+
+    def add_pages(self, pages: Pages | list[Page]) -> None:
+        # formatversion 2 lists the pages, the default keys them by pageid
+        if isinstance(pages, list):
+            for page in pages:
+                self.add_page(page)
+        else:
+            for key, page in pages.items():
+                self.add_page(page, key)
+
+    def add_page(self, page: Page, key: int | str | None = None) -> None:
+        """
+        Adds a page listed under key, or to a formatversion 2 list without a key.
+        """
+        query = self.result.setdefault("query", {})
+        if key is None:
+            key = self.page_key(page)
+            result = query.setdefault("pages", [])
+        else:
+            result = query.setdefault("pages", {})
+
+        merged = self.pages.get(key)
+        if merged is None:
+            # copied one level down, so that appending never alters the response
+            merged = self.pages[key] = {
+                k: list(v) if isinstance(v, list) else v for k, v in page.items()
+            }
+            if isinstance(result, list):
+                result.append(merged)
+            else:
+                result[key] = merged
+            return
+
+        for k, v in page.items():
+            if isinstance(v, list) and isinstance(merged.get(k), list):
+                merged[k].extend(v)
+            else:
+                merged[k] = v
+
+
+class FandomClient:
+    """
+    HTTP client of one fandom wiki, owning a pooled session so that its requests
+    reuse kept-alive connections instead of paying for a new handshake each time.
+    """
+
+    def __init__(
+        self,
+        wiki: str,
+        pool_size: int = DefaultPoolSize,
+        headers: dict[str, str] | None = None,
+    ) -> None:
+        self.wiki = wiki
+        self.base_url = f"https://{wiki}.fandom.com"
+        self.api_url = f"{self.base_url}/api.php"
+        self.session = requests.Session()
+        self.session.headers.update(DefaultHeaders if headers is None else headers)
+        self.session.mount(
+            "https://", HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        )
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.session.get(url, **kwargs)
+
+    def close(self) -> None:
+        self.session.close()
+
+
+# wiki -> its client, shared by every fetch function of the process
+clients: dict[str, FandomClient] = {}
+clients_lock = threading.Lock()
+
+
+def get_client(wiki: str = Wiki) -> FandomClient:
+    with clients_lock:
+        if wiki not in clients:
+            clients[wiki] = FandomClient(wiki)
+        return clients[wiki]
+
+
+def set_client(client: FandomClient) -> None:
+    """
+    Replaces the client of client.wiki, for example with another pool size.
+    """
+    with clients_lock:
+        previous = clients.get(client.wiki)
+        clients[client.wiki] = client
+    if previous is not None and previous is not client:
+        previous.close()
+
+
+def get_client_of(api_url: str) -> FandomClient:
+    return get_client(urlparse(api_url).hostname.split(".")[0])
+
+
+def add_query_page(
+    accumulator: QueryAccumulator, response: QueryResponse, params: dict[str, str]
+) -> bool:
+    """
+    Merges one page of a query into accumulator, updating params to continue from
+    it.
+
+    Returns whether there are more pages to fetch.
+    """
+    if "error" in response:
+        raise Exception(response["error"])
+    if "warnings" in response:
+        print(response["warnings"])
+
+    accumulator.add(response)
+
+    if "continue" in response:
+        # clcontinue for category listings, rvcontinue for batched page contents
+        params.update(response["continue"])
+        return True
+    # the end of pagination
+    return False
+
+
+def drop_discarded_fields(pairs: list[tuple[str, Any]]) -> dict:
+    return {key: value for key, value in pairs if key not in DiscardedFields}
+
+
+def decode_query_stream(
+    chunks: Iterable[bytes], accumulator: QueryAccumulator
+) -> QueryResponse:
+    """
+    Decodes a query response as its chunks arrive, adding each of its pages to
+    accumulator as soon as the page is complete and discarding the fields in
+    DiscardedFields, so the raw body is never held whole.
+
+    Returns the rest of the response, without its pages.
+    """
+    stream = JsonStream(chunks, object_pairs_hook=drop_discarded_fields)
+    response: QueryResponse = QueryResponse()
+
+    for key in stream.keys():
+        if key in DiscardedFields:
+            stream.skip()
+            continue
+        if key != "query":
+            response[key] = stream.value()
+            continue
+
+        query = response["query"] = {}
+        for query_key in stream.keys():
+            if query_key != "pages":
+                query[query_key] = stream.value()
+            elif stream.peek() == "[":
+                for _ in stream.elements():
+                    accumulator.add_page(stream.value())
+            else:
+                for page_key in stream.keys():
+                    accumulator.add_page(stream.value(), page_key)
+
+    return response
+
+
 def query_all(
-    params: dict[str, str], api_url="https://genshin-impact.fandom.com/api.php"
+    params: dict[str, str],
+    api_url="https://genshin-impact.fandom.com/api.php",
+    stream: bool | None = None,
 ) -> QueryResponse:
-    result: QueryResponse = QueryResponse()
+    accumulator = QueryAccumulator()
     start = 0
+    client = get_client_of(api_url)
+    if stream is None:
+        stream = StreamResponses
 
     while start < MaxContinues:
-        response: QueryResponse = requests.get(
-            api_url,
-            params=params,
-        ).json()
+        if stream:
+            with client.get(api_url, params=params, stream=True) as r:
+                response = decode_query_stream(
+                    r.iter_content(chunk_size=StreamChunkSize), accumulator
+                )
+        else:
+            response: QueryResponse = client.get(
+                api_url,
+                params=params,
+            ).json()
 
-        if "error" in response:
-            raise Exception(response["error"])
-        if "warnings" in response:
-            print(response["warnings"])
+        start += 1
+        if not add_query_page(accumulator, response, params):
+            break
 
-        merge(result, response, strategy=Strategy.ADDITIVE)
+    result = accumulator.result
+    result["total_pages"] = start
+    return result
 
-        start += 1
 
-        if "continue" in response:
-            params["clcontinue"] = response["continue"]["clcontinue"]
-            params["continue"] = response["continue"]["continue"]
-            # break out of the loop when we reach the end of pagination
-            continue
-        break
+def open_async_session(pool_size: int = DefaultPoolSize) -> "aiohttp.ClientSession":
+    """
+    An aiohttp session with the same pooling and headers as FandomClient. It
+    belongs to the running event loop, which should share it between fetches.
+    """
+    try:
+        import aiohttp
+    except ImportError as e:
+        raise ImportError("The async fetchers require aiohttp") from e
+
+    return aiohttp.ClientSession(
+        headers=DefaultHeaders,
+        connector=aiohttp.TCPConnector(limit_per_host=pool_size),
+    )
+
+
+@contextlib.asynccontextmanager
+async def async_session(
+    session: "aiohttp.ClientSession | None",
+) -> AsyncIterator["aiohttp.ClientSession"]:
+    # a session of the caller is left open, a temporary one is closed after use
+    if session is not None:
+        yield session
+        return
+
+    async with open_async_session() as session:
+        yield session
+
+
+async def query_all_async(
+    params: dict[str, str],
+    api_url="https://genshin-impact.fandom.com/api.php",
+    session: "aiohttp.ClientSession | None" = None,
+) -> QueryResponse:
+    accumulator = QueryAccumulator()
+    start = 0
+
+    async with async_session(session) as session:
+        while start < MaxContinues:
+            async with session.get(api_url, params=params) as r:
+                # fandom does not always answer with an application/json type
+                response: QueryResponse = await r.json(content_type=None)
 
+            start += 1
+            if not add_query_page(accumulator, response, params):
+                break
+
+    result = accumulator.result
     result["total_pages"] = start
     return result
 
 
+async def download_image_async(
+    output_path: str | Path,
+    url: str,
+    name: str,
+    session: "aiohttp.ClientSession | None" = None,
+):
+    async with async_session(session) as session:
+        async with session.get(url) as r:
+            if r.status != 200:
+                logging.warning(
+                    f"Received status {r.status} trying to download image {name}"
+                )
+                return
+
+            # the file is written from a thread, not to block the event loop on disk
+            f = await asyncio.to_thread(open, output_path, "wb")
+            try:
+                async for chunk in r.content.iter_chunked(64 * 1024):
+                    await asyncio.to_thread(f.write, chunk)
+            finally:
+                await asyncio.to_thread(f.close)
+
+
+def fetch_all(
+    queries: dict[str, Callable[[], QueryResponse]],
+    workers: int = DefaultFetchWorkers,
+) -> dict[str, QueryResponse]:
+    """
+    Runs independent queries concurrently on at most workers threads, returning
+    their responses under the same keys once all of them are done.
+    """
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(queries)))) as pool:
+        futures = {key: pool.submit(query) for key, query in queries.items()}
+        return {key: future.result() for key, future in futures.items()}
+
+
 def get_event_wishes() -> QueryResponse:
     logging.info("gathering all event wishes")
     return query_all(
@@ -95,6 +422,24 @@ def get_event_wishes() -> QueryResponse:
     )
 
 
+async def get_event_wishes_async(
+    session: "aiohttp.ClientSession | None" = None,
+) -> QueryResponse:
+    logging.info("gathering all event wishes")
+    return await query_all_async(
+        {
+            "action": "query",
+            "generator": "categorymembers",
+            "gcmtitle": "Category:Event_Wishes",
+            "prop": "categories",
+            "cllimit": "max",
+            "gcmlimit": "max",
+            "format": "json",
+        },
+        session=session,
+    )
+
+
 def get_chronicled_wishes() -> QueryResponse:
     logging.info("gathering all chronicled wishes")
     return query_all(
@@ -164,37 +509,65 @@ def get_4_star_weapons() -> QueryResponse:
 
 def download_character_image(output_path: str | Path, character_name: str, size: int):
     logging.info(f"downloading {character_name} icon to {output_path}")
-    r = requests.get(
+    with get_client().get(
         f"https://genshin-impact.fandom.com/index.php?title=Special:Redirect/file/{character_name} Icon.png&width={size}&height={size}",
         stream=True,
-    )
-
-    if r.status_code != 200:
-        logging.warning(
-            f"Received status {r.status_code} trying to download weapon image {character_name}"
-        )
-    else:
-        with open(output_path, "wb") as f:
-            r.raw.decode_content = True
-            shutil.copyfileobj(r.raw, f)
+    ) as r:
+        if r.status_code != 200:
+            logging.warning(
+                f"Received status {r.status_code} trying to download weapon image {character_name}"
+            )
+        else:
+            with open(output_path, "wb") as f:
+                r.raw.decode_content = True
+                shutil.copyfileobj(r.raw, f)
 
 
 def download_weapon_image(output_path: str | Path, weapon_name: str, size: int):
     logging.info(f"downloading {weapon_name} icon to {output_path}")
 
-    r = requests.get(
+    with get_client().get(
         f"https://genshin-impact.fandom.com/index.php?title=Special:Redirect/file/Weapon {weapon_name}.png&width={size}&height={size}",
         stream=True,
+    ) as r:
+        if r.status_code != 200:
+            logging.warning(
+                f"Received status {r.status_code} trying to download weapon image {weapon_name}"
+            )
+        else:
+            with open(output_path, "wb") as f:
+                r.raw.decode_content = True
+                shutil.copyfileobj(r.raw, f)
+
+
+async def download_character_image_async(
+    output_path: str | Path,
+    character_name: str,
+    size: int,
+    session: "aiohttp.ClientSession | None" = None,
+):
+    logging.info(f"downloading {character_name} icon to {output_path}")
+    await download_image_async(
+        output_path,
+        f"https://genshin-impact.fandom.com/index.php?title=Special:Redirect/file/{character_name} Icon.png&width={size}&height={size}",
+        character_name,
+        session,
     )
 
-    if r.status_code != 200:
-        logging.warning(
-            f"Received status {r.status_code} trying to download weapon image {weapon_name}"
-        )
-    else:
-        with open(output_path, "wb") as f:
-            r.raw.decode_content = True
-            shutil.copyfileobj(r.raw, f)
+
+async def download_weapon_image_async(
+    output_path: str | Path,
+    weapon_name: str,
+    size: int,
+    session: "aiohttp.ClientSession | None" = None,
+):
+    logging.info(f"downloading {weapon_name} icon to {output_path}")
+    await download_image_async(
+        output_path,
+        f"https://genshin-impact.fandom.com/index.php?title=Special:Redirect/file/Weapon {weapon_name}.png&width={size}&height={size}",
+        weapon_name,
+        session,
+    )
 
 
 def get_page_content(page_id: int) -> QueryResponse:
@@ -210,3 +583,49 @@ def get_page_content(page_id: int) -> QueryResponse:
             "formatversion": "2",
         }
     )
+
+
+async def get_page_content_async(
+    page_id: int, session: "aiohttp.ClientSession | None" = None
+) -> QueryResponse:
+    logging.info(f"fetching page content for {page_id}")
+    return await query_all_async(
+        {
+            "action": "query",
+            "pageids": str(page_id),
+            "prop": "revisions",
+            "rvprop": "content",
+            "rvslots": "main",
+            "format": "json",
+            "formatversion": "2",
+        },
+        session=session,
+    )
+
+
+def get_pages_content(page_ids: list[int]) -> QueryResponse:
+    logging.info(f"fetching page content for {len(page_ids)} pages")
+    return query_all(
+        {
+            "action": "query",
+            "pageids": "|".join(str(page_id) for page_id in page_ids),
+            "prop": "revisions",
+            "rvprop": "content",
+            "rvslots": "main",
+            "format": "json",
+            "formatversion": "2",
+        }
+    )
+
+
+def get_pages_info(page_ids: list[int]) -> QueryResponse:
+    logging.info(f"fetching page info for {len(page_ids)} pages")
+    return query_all(
+        {
+            "action": "query",
+            "pageids": "|".join(str(page_id) for page_id in page_ids),
+            "prop": "info",
+            "format": "json",
+            "formatversion": "2",
+        }
+    )
@@ -2,6 +2,8 @@ from samsara import banners, hsr_fandom
 
 
 class BannersParser(banners.BannersParser):
+    Wiki = "honkai-star-rail"
+
     def __int__(self):
         super.__init__(self)
         # self.CategoryVersionPrefix = "Category:Released in Version "
@@ -12,6 +14,12 @@ class BannersParser(banners.BannersParser):
         return hsr_fandom.get_page_content(page_id)["query"]["pages"][0]["revisions"][
             0
         ]["slots"]["main"]["content"]
+
+    def fetch_pages_content(self, page_ids: list[int]) -> dict[int, str]:
+        return banners.get_revision_contents(hsr_fandom.get_pages_content(page_ids))
+
+    def fetch_pages_revisions(self, page_ids: list[int]) -> dict[int, int]:
+        return banners.get_last_revision_ids(hsr_fandom.get_pages_info(page_ids))
     
     def convert_specialization_page_to_title(self, page: str) -> str:
         title = super().convert_specialization_page_to_title(page)
@@ -1,10 +1,20 @@
 import logging
 import shutil
 from pathlib import Path
+from typing import TYPE_CHECKING
 
-import requests as requests
+from samsara.fandom import (
+    QueryResponse,
+    download_image_async,
+    get_client,
+    query_all,
+    query_all_async,
+)
 
-from samsara.fandom import QueryResponse, query_all
+if TYPE_CHECKING:
+    import aiohttp
+
+Wiki = "honkai-star-rail"
 
 
 def get_event_wishes() -> QueryResponse:
@@ -23,6 +33,25 @@ def get_event_wishes() -> QueryResponse:
     )
 
 
+async def get_event_wishes_async(
+    session: "aiohttp.ClientSession | None" = None,
+) -> QueryResponse:
+    logging.info("gathering all event wishes")
+    return await query_all_async(
+        {
+            "action": "query",
+            "generator": "categorymembers",
+            "gcmtitle": "Category:Event_Warps",
+            "prop": "categories",
+            "cllimit": "max",
+            "gcmlimit": "max",
+            "format": "json",
+        },
+        api_url="https://honkai-star-rail.fandom.com/api.php",
+        session=session,
+    )
+
+
 def get_5_star_characters() -> QueryResponse:
     logging.info("gathering all 5 star characters")
     return query_all(
@@ -82,37 +111,65 @@ def get_4_star_weapons() -> QueryResponse:
 def download_character_image(output_path: str | Path, character_name: str, size: int):
     logging.info(f"downloading {character_name} icon to {output_path}")
     # https://honkai-star-rail.fandom.com/index.php?title=Special:Redirect/file/Character%20Hook%20Icon.png
-    r = requests.get(
+    with get_client(Wiki).get(
         f"https://honkai-star-rail.fandom.com/index.php?title=Special:Redirect/file/Character {character_name} Icon.png&width={size}&height={size}",
         stream=True,
-    )
-
-    if r.status_code != 200:
-        logging.warning(
-            f"Received status {r.status_code} trying to download character image {character_name}"
-        )
-    else:
-        with open(output_path, "wb") as f:
-            r.raw.decode_content = True
-            shutil.copyfileobj(r.raw, f)
+    ) as r:
+        if r.status_code != 200:
+            logging.warning(
+                f"Received status {r.status_code} trying to download character image {character_name}"
+            )
+        else:
+            with open(output_path, "wb") as f:
+                r.raw.decode_content = True
+                shutil.copyfileobj(r.raw, f)
 
 
 def download_weapon_image(output_path: str | Path, weapon_name: str, size: int):
     logging.info(f"downloading {weapon_name} icon to {output_path}")
 
-    r = requests.get(
+    with get_client(Wiki).get(
         f"https://honkai-star-rail.fandom.com/index.php?title=Special:Redirect/file/Light Cone {weapon_name} Icon.png&width={size}&height={size}",
         stream=True,
+    ) as r:
+        if r.status_code != 200:
+            logging.warning(
+                f"Received status {r.status_code} trying to download weapon image {weapon_name}"
+            )
+        else:
+            with open(output_path, "wb") as f:
+                r.raw.decode_content = True
+                shutil.copyfileobj(r.raw, f)
+
+
+async def download_character_image_async(
+    output_path: str | Path,
+    character_name: str,
+    size: int,
+    session: "aiohttp.ClientSession | None" = None,
+):
+    logging.info(f"downloading {character_name} icon to {output_path}")
+    await download_image_async(
+        output_path,
+        f"https://honkai-star-rail.fandom.com/index.php?title=Special:Redirect/file/Character {character_name} Icon.png&width={size}&height={size}",
+        character_name,
+        session,
     )
 
-    if r.status_code != 200:
-        logging.warning(
-            f"Received status {r.status_code} trying to download weapon image {weapon_name}"
-        )
-    else:
-        with open(output_path, "wb") as f:
-            r.raw.decode_content = True
-            shutil.copyfileobj(r.raw, f)
+
+async def download_weapon_image_async(
+    output_path: str | Path,
+    weapon_name: str,
+    size: int,
+    session: "aiohttp.ClientSession | None" = None,
+):
+    logging.info(f"downloading {weapon_name} icon to {output_path}")
+    await download_image_async(
+        output_path,
+        f"https://honkai-star-rail.fandom.com/index.php?title=Special:Redirect/file/Light Cone {weapon_name} Icon.png&width={size}&height={size}",
+        weapon_name,
+        session,
+    )
 
 
 def get_page_content(page_id: int) -> QueryResponse:
@@ -129,3 +186,52 @@ def get_page_content(page_id: int) -> QueryResponse:
         },
         api_url="https://honkai-star-rail.fandom.com/api.php",
     )
+
+
+async def get_page_content_async(
+    page_id: int, session: "aiohttp.ClientSession | None" = None
+) -> QueryResponse:
+    logging.info(f"fetching page content for {page_id}")
+    return await query_all_async(
+        {
+            "action": "query",
+            "prop": "revisions",
+            "pageids": str(page_id),
+            "rvprop": "content",
+            "rvslots": "main",
+            "format": "json",
+            "formatversion": "2",
+        },
+        api_url="https://honkai-star-rail.fandom.com/api.php",
+        session=session,
+    )
+
+
+def get_pages_content(page_ids: list[int]) -> QueryResponse:
+    logging.info(f"fetching page content for {len(page_ids)} pages")
+    return query_all(
+        {
+            "action": "query",
+            "prop": "revisions",
+            "pageids": "|".join(str(page_id) for page_id in page_ids),
+            "rvprop": "content",
+            "rvslots": "main",
+            "format": "json",
+            "formatversion": "2",
+        },
+        api_url="https://honkai-star-rail.fandom.com/api.php",
+    )
+
+
+def get_pages_info(page_ids: list[int]) -> QueryResponse:
+    logging.info(f"fetching page info for {len(page_ids)} pages")
+    return query_all(
+        {
+            "action": "query",
+            "pageids": "|".join(str(page_id) for page_id in page_ids),
+            "prop": "info",
+            "format": "json",
+            "formatversion": "2",
+        },
+        api_url="https://honkai-star-rail.fandom.com/api.php",
+    )
@@ -0,0 +1,118 @@
+import codecs
+import json
+from typing import Any, Callable, Iterable, Iterator
+
+# what a number cut off at the end of a chunk may continue with
+NumberChars = "0123456789+-.eE"
+
+
+class JsonStream:
+    """
+    Incremental reader of a JSON document arriving in chunks.
+
+    Objects and arrays can be walked member by member with keys() and elements(),
+    and any value can be decoded with value() (through json.JSONDecoder) as soon
+    as it is complete, so only the value being read has to be buffered.
+    """
+
+    def __init__(
+        self,
+        chunks: Iterable[bytes | str],
+        object_pairs_hook: Callable[[list[tuple[str, Any]]], Any] | None = None,
+    ) -> None:
+        self.chunks = iter(chunks)
+        self.text = codecs.getincrementaldecoder("utf-8")()
+        self.decoder = json.JSONDecoder(object_pairs_hook=object_pairs_hook)
+        self.buffer = ""
+        self.pos = 0
+        self.done = False
+
+    def fill(self) -> bool:
+        """
+        Appends the next chunk to the buffer, dropping what was already read.
+
+        Returns False at the end of the document.
+        """
+        if self.done:
+            return False
+
+        for chunk in self.chunks:
+            text = chunk if isinstance(chunk, str) else self.text.decode(chunk)
+            if text:
+                self.buffer = self.buffer[self.pos :] + text
+                self.pos = 0
+                return True
+
+        # raises on a truncated multibyte character
+        self.text.decode(b"", final=True)
+        self.done = True
+        return False
+
+    def peek(self) -> str:
+        """
+        The next character that is not whitespace, or "" at the end.
+        """
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in " \t\r\n":
+                self.pos += 1
+            if self.pos < len(self.buffer) or not self.fill():
+                return self.buffer[self.pos : self.pos + 1]
+
+    def expect(self, char: str) -> None:
+        found = self.peek()
+        if found != char:
+            raise ValueError(f"Expected {char!r} at {self.pos}, found {found!r}")
+        self.pos += 1
+
+    def value(self) -> Any:
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buffer, self.pos)
+            except json.JSONDecodeError:
+                if not self.fill():
+                    raise
+                continue
+
+            # a number at the end of the buffer may continue in the next chunk
+            if (
+                not isinstance(value, (int, float))
+                or isinstance(value, bool)
+                or self.buffer[end:].strip(NumberChars)
+                or not self.fill()
+            ):
+                self.pos = end
+                return value
+
+    def skip(self) -> None:
+        self.value()
+
+    def members(self, close: str) -> Iterator[None]:
+        first = True
+        while True:
+            char = self.peek()
+            if char == close:
+                self.pos += 1
+                return
+            if not first:
+                self.expect(",")
+            first = False
+            yield
+
+    def keys(self) -> Iterator[str]:
+        """
+        Yields the keys of an object. The caller reads (or skips) the value of each
+        key before asking for the next one.
+        """
+        self.expect("{")
+        for _ in self.members("}"):
+            key = self.value()
+            self.expect(":")
+            yield key
+
+    def elements(self) -> Iterator[None]:
+        """
+        Yields once per element of an array, which the caller then reads.
+        """
+        self.expect("[")
+        yield from self.members("]")
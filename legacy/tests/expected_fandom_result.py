@@ -1,5 +1,4 @@
 MergedQueryAllResult = {
-    "continue": {"clcontinue": "209266|Event_Wishes", "continue": "||"},
     "limits": {"categorymembers": 500, "categories": 500},
     "query": {
         "pages": {
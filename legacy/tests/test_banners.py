@@ -1,5 +1,26 @@
+import copy
+import random
+from datetime import date, timedelta
 from unittest import mock
-from samsara.banners import BannersParser, parse_version_with_luna
+
+import pytest
+import yaml
+
+from samsara.fandom import QueryResponse
+from samsara import hsr_banners
+from samsara.banners import (
+    BannersParser,
+    BannerTitle,
+    InvalidDay,
+    TitleClassifier,
+    VersionCatalog,
+    format_banner_day,
+    get_changed_pages,
+    get_qr_page_titles,
+    parse_banner_day,
+    parse_version_with_luna,
+)
+from samsara.cache import LRUPageCache, PersistentPageCache
 from tests.expected_banner_results import ExpectedTransformedData
 from tests.mock_query_responses import (
     MockEventWishesQueryResponse,
@@ -9,9 +30,12 @@ from tests.mock_query_responses import (
     MockFiveStarWeaponQueryResponse,
 )
 
+NoPagesQueryResponse = {"query": {"pages": []}}
+
 
+@mock.patch("samsara.fandom.get_pages_content", return_value=NoPagesQueryResponse)
 @mock.patch("samsara.fandom.get_page_content", return_value={})
-def test_transform_data(get_page_content_mock):
+def test_transform_data(get_page_content_mock, get_pages_content_mock):
     assert ExpectedTransformedData == BannersParser().transform_data(
         MockEventWishesQueryResponse,
         MockFiveStarCharacterQueryResponse,
@@ -21,6 +45,485 @@ def test_transform_data(get_page_content_mock):
     )
 
 
+@mock.patch("samsara.fandom.get_pages_content", return_value=NoPagesQueryResponse)
+@mock.patch("samsara.fandom.get_page_content", return_value={})
+def test_transform_data_page_without_categories(
+    get_page_content_mock, get_pages_content_mock
+):
+    # MediaWiki leaves out the categories of a page that has none
+    event_wishes = copy.deepcopy(MockEventWishesQueryResponse)
+    event_wishes["query"]["pages"]["999999"] = {
+        "pageid": 999999,
+        "title": "Foo/2024-01-01",
+    }
+
+    assert ExpectedTransformedData == BannersParser().transform_data(
+        event_wishes,
+        copy.deepcopy(MockFiveStarCharacterQueryResponse),
+        copy.deepcopy(MockFourStarCharacterQueryResponse),
+        copy.deepcopy(MockFiveStarWeaponQueryResponse),
+        copy.deepcopy(MockFourStarWeaponQueryResponse),
+    )
+
+
+@mock.patch("samsara.fandom.get_pages_content", return_value=NoPagesQueryResponse)
+@mock.patch("samsara.fandom.get_page_content", return_value={})
+def test_transform_data_columnar(get_page_content_mock, get_pages_content_mock):
+    pytest.importorskip("numpy")
+
+    assert ExpectedTransformedData == BannersParser(engine="columnar").transform_data(
+        copy.deepcopy(MockEventWishesQueryResponse),
+        copy.deepcopy(MockFiveStarCharacterQueryResponse),
+        copy.deepcopy(MockFourStarCharacterQueryResponse),
+        copy.deepcopy(MockFiveStarWeaponQueryResponse),
+        copy.deepcopy(MockFourStarWeaponQueryResponse),
+    )
+
+
+def make_random_banners(seed: int) -> tuple:
+    """
+    Random event wishes plus the four featured categories: two phases per version
+    with reruns, several character banners per phase, Luna versions and an
+    upcoming version whose banners only have an "x.y" breadcrumb.
+    """
+    rng = random.Random(seed)
+    versions = ["1.0", "1.1", "2.0", "5.8", "Luna I", "Luna II", "6.0"]
+    characters = [f"Character {i}" for i in range(12)]
+    weapons = [f"Weapon {i}" for i in range(12)]
+    pages = {}
+    day = date(2020, 9, 28)
+
+    for version in versions:
+        upcoming = version == versions[-1]
+        phases = [[], []]
+        for phase in phases:
+            banners = [(False, rng.randint(0, 3)) for _ in range(rng.randint(1, 2))]
+            for is_weapon, featured in banners + [(True, rng.randint(0, 3))]:
+                pool = [
+                    name
+                    for name in (weapons if is_weapon else characters)
+                    if not any(name in other for other in phases)
+                ]
+                featured = rng.sample(pool, min(len(pool), featured + 1))
+                phase.extend(featured)
+
+                pageid = len(pages) + 1
+                pages[str(pageid)] = {
+                    "pageid": pageid,
+                    "title": ("Epitome Invocation/" if is_weapon else "Ballad/")
+                    + ("6.0" if upcoming else day.isoformat()),
+                    "categories": [
+                        {"title": f"Category:Features {name}"} for name in featured
+                    ],
+                }
+                if not upcoming:
+                    pages[str(pageid)]["categories"].append(
+                        {"title": f"Category:Released in Version {version}"}
+                    )
+            day += timedelta(days=21)
+
+    def category(names: list[str]) -> QueryResponse:
+        return {
+            "query": {
+                "pages": {
+                    str(i): {"pageid": i, "title": name} for i, name in enumerate(names)
+                }
+            }
+        }
+
+    return (
+        {"query": {"pages": pages}},
+        category(characters[:6]),
+        category(characters[6:]),
+        category(weapons[:6]),
+        category(weapons[6:]),
+    )
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_transform_data_columnar_matches_python(seed):
+    pytest.importorskip("numpy")
+
+    def dump(engine: str) -> str:
+        data = BannersParser(engine=engine).transform_data(*make_random_banners(seed))
+        return yaml.dump(data, sort_keys=False)
+
+    assert dump("python") == dump("columnar")
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_patch_data_matches_full_recompute(seed):
+    rng = random.Random(seed)
+    event_wishes, *categories = make_random_banners(seed)
+    pages = event_wishes["query"]["pages"]
+
+    # the previous run lacks a few pages, had an extra one and saw one page differ
+    previous_pages = copy.deepcopy(pages)
+    for key in rng.sample(sorted(previous_pages), 3):
+        del previous_pages[key]
+    extra = copy.deepcopy(pages[rng.choice(sorted(pages))])
+    extra["pageid"] = len(pages) + 1
+    extra["categories"] = extra["categories"][-1:]
+    previous_pages[str(extra["pageid"])] = extra
+    changed = previous_pages[rng.choice(sorted(previous_pages))]
+    changed["categories"] = changed["categories"][1:]
+    previous_event_wishes = {"query": {"pages": previous_pages}}
+
+    previous = BannersParser().transform_data(
+        previous_event_wishes, *copy.deepcopy(categories)
+    )
+    patched = BannersParser().patch_data(
+        previous,
+        get_changed_pages(previous_event_wishes, event_wishes),
+        event_wishes,
+        *copy.deepcopy(categories),
+        verify=True,
+    )
+
+    assert patched == BannersParser().transform_data(event_wishes, *categories)
+
+
+def make_banner_page(pageid: int, title: str, version: str, *featured: str) -> dict:
+    return {
+        "pageid": pageid,
+        "title": title,
+        "categories": [{"title": f"Category:Features {name}"} for name in featured]
+        + [{"title": f"Category:Released in Version {version}"}],
+    }
+
+
+def test_get_affected_names():
+    pages = [
+        make_banner_page(1, "Ballad in Goblets/2020-09-28", "1.0", "Venti", "Fischl"),
+        make_banner_page(2, "Epitome Invocation/2020-09-28", "1.0", "Amos' Bow"),
+        make_banner_page(3, "Farewell of Snezhnaya/2020-11-11", "1.1", "Tartaglia"),
+        make_banner_page(4, "Epitome Invocation/2020-11-11", "1.1", "Skyward Harp"),
+        make_banner_page(5, "Gentry of Hermitage/2020-12-01", "1.1", "Zhongli"),
+        make_banner_page(6, "Secretum Secretorum/2020-12-23", "1.2", "Albedo"),
+    ]
+    event_wishes = {"query": {"pages": {str(p["pageid"]): p for p in pages}}}
+    parser = BannersParser()
+    index = parser.build_index(event_wishes)
+
+    # itself, the character banner ending where it starts and the other character
+    # banner of 1.1, but not the weapon banners nor the other versions
+    assert parser.get_affected_names(index, [pages[2]]) == {
+        "Tartaglia",
+        "Venti",
+        "Fischl",
+        "Zhongli",
+    }
+    assert parser.get_affected_names(index, [pages[3]]) == {
+        "Skyward Harp",
+        "Amos' Bow",
+    }
+
+
+@mock.patch("samsara.fandom.get_pages_content", return_value=NoPagesQueryResponse)
+@mock.patch("samsara.fandom.get_page_content", return_value={})
+def test_transform_data_in_parallel(get_page_content_mock, get_pages_content_mock):
+    assert ExpectedTransformedData == BannersParser(workers=4).transform_data(
+        copy.deepcopy(MockEventWishesQueryResponse),
+        copy.deepcopy(MockFiveStarCharacterQueryResponse),
+        copy.deepcopy(MockFourStarCharacterQueryResponse),
+        copy.deepcopy(MockFiveStarWeaponQueryResponse),
+        copy.deepcopy(MockFourStarWeaponQueryResponse),
+    )
+
+
+@mock.patch("samsara.fandom.get_pages_content", return_value=NoPagesQueryResponse)
+@mock.patch("samsara.fandom.get_page_content", return_value={})
+def test_iter_transform_data(get_page_content_mock, get_pages_content_mock):
+    histories = BannersParser().iter_transform_data(
+        copy.deepcopy(MockEventWishesQueryResponse),
+        copy.deepcopy(MockFiveStarCharacterQueryResponse),
+        copy.deepcopy(MockFourStarCharacterQueryResponse),
+        copy.deepcopy(MockFiveStarWeaponQueryResponse),
+        copy.deepcopy(MockFourStarWeaponQueryResponse),
+    )
+
+    featured_type, history_list = next(histories)
+    assert featured_type == "fiveStarCharacters"
+    assert next(history_list) == ExpectedTransformedData["fiveStarCharacters"][0]
+
+    data = {featured_type: [ExpectedTransformedData[featured_type][0], *history_list]}
+    data.update((name, list(history_list)) for name, history_list in histories)
+    assert ExpectedTransformedData == data
+
+
+@mock.patch("samsara.fandom.get_pages_content", return_value=NoPagesQueryResponse)
+@mock.patch("samsara.fandom.get_page_content", return_value={})
+def test_transform_data_parses_each_page_once(
+    get_page_content_mock, get_pages_content_mock
+):
+    parser = BannersParser()
+    with mock.patch.object(
+        parser, "get_featured_names", wraps=parser.get_featured_names
+    ) as get_featured_names:
+        parser.transform_data(
+            MockEventWishesQueryResponse,
+            MockFiveStarCharacterQueryResponse,
+            MockFourStarCharacterQueryResponse,
+            MockFiveStarWeaponQueryResponse,
+            MockFourStarWeaponQueryResponse,
+        )
+
+    index = parser.build_index(MockEventWishesQueryResponse)
+    assert get_featured_names.call_count == len(index.pages)
+
+
+@mock.patch("samsara.fandom.get_pages_content", return_value=NoPagesQueryResponse)
+@mock.patch("samsara.fandom.get_page_content", return_value={})
+def test_build_index_phases(get_page_content_mock, get_pages_content_mock):
+    index = BannersParser().build_index(MockEventWishesQueryResponse)
+
+    assert index.phases[("3.5", False)] == {"2023-03-01": 1, "2023-03-21": 2}
+    assert index.phases[("3.5", True)] == {"2023-03-01": 1, "2023-03-21": 2}
+    # pages without a valid date sort after the dated ones
+    assert index.phases[("3.6", False)] == {"2023-04-12": 1, "3.6": 2}
+
+
+@mock.patch("samsara.fandom.get_pages_content", return_value=NoPagesQueryResponse)
+@mock.patch("samsara.fandom.get_page_content", return_value={})
+def test_get_next_banner_date(get_page_content_mock, get_pages_content_mock):
+    parser = BannersParser()
+    index = parser.build_index(MockEventWishesQueryResponse)
+
+    def next_banner_date(start_date: str, is_weapon: bool) -> str:
+        return format_banner_day(
+            parser.get_next_banner_date(index, parse_banner_day(start_date), is_weapon)
+        )
+
+    assert "2020-10-20" == next_banner_date("2020-09-28", True)
+    assert "2020-10-20" == next_banner_date("2020-10-01", False)
+    assert "" == next_banner_date("3.6", False)
+    assert InvalidDay == parse_banner_day("3.6")
+
+
+@mock.patch("samsara.fandom.get_pages_content", return_value=NoPagesQueryResponse)
+@mock.patch("samsara.fandom.get_page_content", return_value={})
+def test_build_index_pages_by_featured(get_page_content_mock, get_pages_content_mock):
+    index = BannersParser().build_index(MockEventWishesQueryResponse)
+
+    assert [(p.name, p.date) for p in index.pages_by_featured["Venti"]] == [
+        ("Ballad in Goblets", "2020-09-28"),
+        ("Ballad in Goblets", "2021-03-17"),
+        ("Ballad in Goblets", "2022-03-30"),
+        ("Ballad in Goblets", "2022-09-28"),
+    ]
+    assert "Crescent Pike" not in index.pages_by_featured
+
+
+@mock.patch("samsara.fandom.get_pages_content", return_value=NoPagesQueryResponse)
+@mock.patch("samsara.fandom.get_page_content", return_value={})
+def test_build_index_featured_queries(get_page_content_mock, get_pages_content_mock):
+    index = BannersParser().build_index(MockEventWishesQueryResponse)
+    four_star_characters = get_qr_page_titles(
+        MockFourStarCharacterQueryResponse, "Category:4-Star Characters"
+    )
+
+    assert index.pages_featuring("Venti") == index.pages_by_featured["Venti"]
+    assert index.names_of(index.pages_featuring("Venti")[0].featured_mask) == [
+        "Barbara",
+        "Fischl",
+        "Venti",
+        "Xiangling",
+    ]
+    assert index.featured_with("Venti", four_star_characters)[:4] == [
+        "Barbara",
+        "Fischl",
+        "Xiangling",
+        "Noelle",
+    ]
+    assert [
+        (p.name, p.date)
+        for p in index.pages_in_version("1.0", ["Venti", "Aquila Favonia", "Klee"])
+    ] == [
+        ("Epitome Invocation", "2020-09-28"),
+        ("Ballad in Goblets", "2020-09-28"),
+        ("Sparkling Steps", "2020-10-20"),
+    ]
+    assert index.pages_featuring("Crescent Pike") == []
+
+
+@mock.patch("samsara.fandom.get_pages_content", return_value=NoPagesQueryResponse)
+@mock.patch("samsara.fandom.get_page_content", return_value={})
+def test_filter_invalid_pages_shares_pages(
+    get_page_content_mock, get_pages_content_mock
+):
+    pages = MockEventWishesQueryResponse["query"]["pages"]
+    result = BannersParser().filter_invalid_pages(MockEventWishesQueryResponse)
+
+    assert result["query"]["pages"][2535] is pages["2535"]
+    assert 228413 not in result["query"]["pages"]
+    assert result["query"]["pages"] is not pages
+    assert "228413" in pages
+
+
+@mock.patch("samsara.fandom.get_pages_content", return_value=NoPagesQueryResponse)
+@mock.patch("samsara.fandom.get_page_content", return_value={})
+def test_version_cache(get_page_content_mock, get_pages_content_mock):
+    parser = BannersParser()
+    index = parser.build_index(MockEventWishesQueryResponse)
+
+    # the page with an unknown version is resolved (and rejected) once
+    assert parser.version_cache_misses == len(index.pages) + 1
+    assert parser.version_cache_hits == len(index.pages)
+    assert parser.version_cache[218997] == "3.6"
+
+    parser.build_index(MockEventWishesQueryResponse)
+    assert parser.version_cache_misses == len(index.pages) + 1
+
+
+@mock.patch("samsara.fandom.get_page_content")
+@mock.patch("samsara.fandom.get_pages_content")
+def test_prefetch_page_contents(get_pages_content_mock, get_page_content_mock):
+    get_pages_content_mock.side_effect = lambda page_ids: {
+        "query": {
+            "pages": [
+                {
+                    "pageid": page_id,
+                    "revisions": [
+                        {"slots": {"main": {"content": "{{Change History|4.2}}"}}}
+                    ],
+                }
+                for page_id in page_ids
+            ]
+        }
+    }
+    qr = {
+        "query": {
+            "pages": {
+                str(page_id): {
+                    "pageid": page_id,
+                    "title": f"Banner/2023-01-{page_id % 28 + 1:02}",
+                    "categories": [{"title": "Category:Features Someone"}],
+                }
+                for page_id in range(1, 121)
+            }
+        }
+    }
+
+    index = BannersParser(page_cache=LRUPageCache()).build_index(qr)
+
+    assert [len(c.args[0]) for c in get_pages_content_mock.call_args_list] == [
+        50,
+        50,
+        20,
+    ]
+    get_page_content_mock.assert_not_called()
+    assert {p.version for p in index.pages} == {"4.2"}
+
+
+@mock.patch("samsara.fandom.get_page_content")
+@mock.patch("samsara.fandom.get_pages_content")
+def test_prefetch_page_contents_missing_page(
+    get_pages_content_mock, get_page_content_mock
+):
+    def reply(*page_ids: int) -> QueryResponse:
+        return {
+            "query": {
+                "pages": [
+                    {
+                        "pageid": page_id,
+                        "revisions": [
+                            {"slots": {"main": {"content": "{{Change History|4.2}}"}}}
+                        ],
+                    }
+                    for page_id in page_ids
+                ]
+            }
+        }
+
+    # the batch reply leaves out page 2, which is then fetched on its own
+    get_pages_content_mock.return_value = reply(1)
+    get_page_content_mock.return_value = reply(2)
+    qr = {
+        "query": {
+            "pages": {
+                str(page_id): {
+                    "pageid": page_id,
+                    "title": f"Banner/2023-01-0{page_id}",
+                    "categories": [{"title": "Category:Features Someone"}],
+                }
+                for page_id in (1, 2)
+            }
+        }
+    }
+
+    index = BannersParser(page_cache=LRUPageCache()).build_index(qr)
+
+    get_page_content_mock.assert_called_once_with(2)
+    assert [p.version for p in index.pages] == ["4.2", "4.2"]
+
+
+@mock.patch("samsara.fandom.get_pages_info")
+@mock.patch("samsara.fandom.get_pages_content")
+def test_prefetch_page_contents_from_store(
+    get_pages_content_mock, get_pages_info_mock, tmp_path
+):
+    get_pages_info_mock.return_value = {
+        "query": {"pages": [{"pageid": 1, "lastrevid": 100}]}
+    }
+    get_pages_content_mock.return_value = {
+        "query": {
+            "pages": [
+                {
+                    "pageid": 1,
+                    "revisions": [
+                        {"slots": {"main": {"content": "{{Change History|4.2}}"}}}
+                    ],
+                }
+            ]
+        }
+    }
+    qr = {
+        "query": {
+            "pages": {
+                "1": {"pageid": 1, "title": "Banner/2023-01-01", "categories": []}
+            }
+        }
+    }
+
+    store = PersistentPageCache(tmp_path / "pages.db", "genshin-impact")
+    BannersParser(content_store=store, page_cache=LRUPageCache()).build_index(qr)
+    assert get_pages_content_mock.call_count == 1
+
+    index = BannersParser(content_store=store, page_cache=LRUPageCache()).build_index(
+        qr
+    )
+    assert get_pages_content_mock.call_count == 1
+    assert index.pages[0].version == "4.2"
+
+
+def test_hsr_version_cache():
+    parser = hsr_banners.BannersParser()
+    page = MockEventWishesQueryResponse["query"]["pages"]["2535"]
+
+    assert parser.get_version_from_page(page) == "1.0"
+    assert parser.get_version_from_page(page) == "1.0"
+    assert (parser.version_cache_hits, parser.version_cache_misses) == (1, 1)
+
+
+def test_title_classifier():
+    classifier = TitleClassifier(r"(Brilliant.Fixation|Bygone.Reminiscence)")
+
+    assert classifier.classify("Brilliant Fixation/2023-04-26") == BannerTitle(
+        name="Brilliant Fixation",
+        date="2023-04-26",
+        is_banner=True,
+        is_weapon=True,
+        is_version=False,
+    )
+    assert classifier.classify("Adrift in the Harbor/3.6") == BannerTitle(
+        "Adrift in the Harbor", "3.6", True, False, True
+    )
+    assert classifier.classify("Adrift in the Harbor/3.6/Gallery").is_version is False
+    assert classifier.classify("Traveler") == BannerTitle(
+        "Traveler", "", False, False, False
+    )
+
+
 def test_parse_version_with_luna():
     """Test that Luna versions are handled correctly"""
     # Test regular versions
@@ -56,3 +559,22 @@ def test_parse_version_with_luna():
     # Test malformed versions
     assert parse_version_with_luna("invalid") == (999, 999, 999)
     assert parse_version_with_luna("Luna X") == (5, 9, 0)  # Unknown roman numeral defaults to 1
+
+
+def test_version_catalog():
+    catalog = VersionCatalog()
+    catalog.add(
+        ["6.0", "1.1", "5.8", "Luna I", "Luna I.1", "5.9", "1.1.0", "invalid", "5.10"]
+    )
+
+    assert catalog.ordinal("1.1") == catalog.ordinal("1.1.0") == 0
+    assert catalog.ordinal("Luna I") == catalog.ordinal("5.9")
+    assert catalog.ordinal("5.8") < catalog.ordinal("Luna I") < catalog.ordinal("6.0")
+    assert catalog.ordinal("5.10") == catalog.ordinal("6.0") - 1 == 3
+    # unknown versions sort last
+    assert catalog.ordinal("Luna I.1") == catalog.ordinal("invalid") == 5
+
+    # versions that were never added have no ordinal
+    with pytest.raises(KeyError):
+        catalog.ordinal("7.0")
+    assert catalog.ordinal("6.0") == 4
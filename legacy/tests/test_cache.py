@@ -0,0 +1,206 @@
+import threading
+from unittest import mock
+
+import pytest
+
+from samsara.banners import BannersParser
+from samsara.cache import LRUPageCache, PageFetchFailed, PersistentPageCache
+
+
+class FakeClock:
+    def __init__(self) -> None:
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_persistent_page_cache(tmp_path):
+    store = PersistentPageCache(tmp_path / "pages.db", "genshin-impact")
+    store.put(1, 100, "{{Change History|1.0}}")
+    store.close()
+
+    store = PersistentPageCache(tmp_path / "pages.db", "genshin-impact")
+    assert store.get(1, 100) == "{{Change History|1.0}}"
+    # the page was edited since it was stored
+    assert store.get(1, 101) is None
+    assert store.get(2, 100) is None
+
+    other_wiki = PersistentPageCache(tmp_path / "pages.db", "honkai-star-rail")
+    assert other_wiki.get(1, 100) is None
+
+
+def test_persistent_page_cache_eviction(tmp_path):
+    clock = FakeClock()
+    store = PersistentPageCache(
+        tmp_path / "pages.db", "genshin-impact", max_entries=2, max_age=60, clock=clock
+    )
+    store.put(1, 100, "a")
+    clock.now += 10
+    store.put(2, 200, "b")
+    clock.now += 10
+    store.put(3, 300, "c")
+    store.evict()
+    assert (store.get(1, 100), len(store)) == (None, 2)
+
+    clock.now += 55
+    assert store.get(3, 300) == "c"
+    store.evict()
+    assert (store.get(2, 200), store.get(3, 300)) == (None, "c")
+
+
+def test_lru_page_cache():
+    cache = LRUPageCache(max_entries=2)
+    cache.put(("genshin-impact", 1), "a")
+    cache.put(("honkai-star-rail", 1), "b")
+    assert cache.get(("genshin-impact", 1)) == "a"
+
+    cache.put(("genshin-impact", 2), "c")
+    assert ("honkai-star-rail", 1) not in cache
+    assert cache.get(("honkai-star-rail", 1)) is None
+    assert (cache.hits, cache.misses, cache.evictions) == (1, 1, 1)
+
+
+def test_lru_page_cache_single_flight():
+    cache = LRUPageCache()
+    started = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def fetch() -> str:
+        calls.append(1)
+        started.set()
+        release.wait()
+        return "content"
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(cache.get_or_fetch(1, fetch)))
+        for _ in range(4)
+    ]
+    threads[0].start()
+    started.wait()
+    for t in threads[1:]:
+        t.start()
+    release.set()
+    for t in threads:
+        t.join()
+
+    assert results == ["content"] * 4
+    assert len(calls) == 1
+
+
+def test_lru_page_cache_reserve():
+    cache = LRUPageCache()
+    cache.put(1, "cached")
+    assert cache.reserve([1, 2, 3]) == [2, 3]
+    assert cache.reserve([2, 3, 4]) == [4]
+
+    results = []
+    waiter = threading.Thread(
+        target=lambda: results.append(cache.get_or_fetch(2, lambda: "fetched"))
+    )
+    waiter.start()
+    cache.put(2, "batched")
+    waiter.join()
+    # a released key is fetched by whoever waits for it
+    cache.release([2, 3, 4])
+
+    assert results == ["batched"]
+    assert cache.get_or_fetch(3, lambda: "fetched") == "fetched"
+
+
+@mock.patch("samsara.fandom.get_page_content")
+@mock.patch("samsara.fandom.get_pages_content")
+def test_build_index_single_flight(get_pages_content_mock, get_page_content_mock):
+    started = threading.Event()
+    release = threading.Event()
+
+    def get_pages_content(page_ids: list[int]):
+        started.set()
+        release.wait()
+        return {
+            "query": {
+                "pages": [
+                    {
+                        "pageid": page_id,
+                        "revisions": [
+                            {"slots": {"main": {"content": "{{Change History|4.2}}"}}}
+                        ],
+                    }
+                    for page_id in page_ids
+                ]
+            }
+        }
+
+    get_pages_content_mock.side_effect = get_pages_content
+    qr = {
+        "query": {
+            "pages": {
+                str(page_id): {
+                    "pageid": page_id,
+                    "title": f"Banner/2023-01-{page_id:02}",
+                    "categories": [{"title": "Category:Features Someone"}],
+                }
+                for page_id in range(1, 11)
+            }
+        }
+    }
+
+    # two parsers on the same wiki, sharing the page cache
+    cache = LRUPageCache()
+    indexes = []
+    threads = [
+        threading.Thread(
+            target=lambda: indexes.append(
+                BannersParser(page_cache=cache).build_index(qr)
+            )
+        )
+        for _ in range(2)
+    ]
+    threads[0].start()
+    started.wait()
+    threads[1].start()
+    release.set()
+    for t in threads:
+        t.join()
+
+    assert get_pages_content_mock.call_count == 1
+    get_page_content_mock.assert_not_called()
+    assert [{p.version for p in index.pages} for index in indexes] == [{"4.2"}] * 2
+
+
+def test_lru_page_cache_failures():
+    clock = FakeClock()
+    cache = LRUPageCache(failure_ttl=60, max_retries=2, backoff_ttl=600, clock=clock)
+    calls = []
+
+    def fail() -> str:
+        calls.append(1)
+        raise ConnectionError("boom")
+
+    with pytest.raises(ConnectionError):
+        cache.get_or_fetch(1, fail)
+    # still within the TTL, so the failure is not retried
+    with pytest.raises(PageFetchFailed):
+        cache.get_or_fetch(1, fail)
+    assert (len(calls), cache.negative_hits, 1 in cache) == (1, 1, False)
+
+    clock.now += 61
+    with pytest.raises(ConnectionError):
+        cache.get_or_fetch(1, fail)
+
+    # out of retries, so it backs off for longer than the TTL
+    clock.now += 61
+    with pytest.raises(PageFetchFailed):
+        cache.get_or_fetch(1, fail)
+    assert len(calls) == 2
+
+    # and recovers once the backoff has passed
+    clock.now += 600
+    assert cache.get_or_fetch(1, lambda: "content") == "content"
+    assert not cache.is_failing(1)
+
+    # genuine empty content is cached like any other content
+    assert cache.get_or_fetch(2, lambda: "") == ""
+    assert cache.get_or_fetch(2, fail) == ""
@@ -1,7 +1,24 @@
+import asyncio
+import json
+import threading
+from unittest import mock
+
+import pytest
 import requests_mock
 
 import samsara.generate
-from samsara.fandom import query_all
+from samsara import fandom, hsr_fandom
+from samsara.fandom import (
+    FandomClient,
+    QueryAccumulator,
+    decode_query_stream,
+    fetch_all,
+    get_client,
+    query_all,
+    query_all_async,
+    set_client,
+)
+from samsara.jsonstream import JsonStream
 from tests.expected_fandom_result import MergedQueryAllResult
 from tests.mock_fandom_responses import FirstQueryAllPage, SecondQueryAllPage
 
@@ -35,3 +52,269 @@ def test_query_all():
                 "format": "json",
             }
         )
+
+
+def test_query_accumulator():
+    first = {
+        "continue": {"rvcontinue": "2|5", "continue": "||"},
+        "query": {
+            "pages": [
+                {"pageid": 1, "title": "A", "revisions": [{"revid": 4}]},
+                {"pageid": 2, "title": "B"},
+            ]
+        },
+    }
+    second = {
+        "query": {
+            "pages": [
+                {"pageid": 2, "title": "B", "revisions": [{"revid": 5}]},
+                {"pageid": 3, "title": "C", "missing": True},
+            ]
+        }
+    }
+
+    accumulator = QueryAccumulator()
+    accumulator.add(first)
+    accumulator.add(second)
+
+    assert accumulator.result == {
+        "query": {
+            "pages": [
+                {"pageid": 1, "title": "A", "revisions": [{"revid": 4}]},
+                {"pageid": 2, "title": "B", "revisions": [{"revid": 5}]},
+                {"pageid": 3, "title": "C", "missing": True},
+            ]
+        }
+    }
+    # the responses themselves are left as they were
+    assert "revisions" not in first["query"]["pages"][1]
+
+    # folding another query into an existing response appends to its categories
+    event_wishes = {
+        "query": {"pages": {"7": {"pageid": 7, "categories": [{"title": "X"}]}}},
+        "total_pages": 1,
+    }
+    accumulator = QueryAccumulator(event_wishes)
+    accumulator.add(
+        {"query": {"pages": {"7": {"pageid": 7, "categories": [{"title": "Y"}]}}}}
+    )
+    accumulator.add({"query": {"pages": {-7: {"pageid": -7, "categories": []}}}})
+
+    assert event_wishes == {
+        "query": {
+            "pages": {
+                "7": {"pageid": 7, "categories": [{"title": "X"}, {"title": "Y"}]},
+                -7: {"pageid": -7, "categories": []},
+            }
+        },
+        "total_pages": 1,
+    }
+
+
+def test_get_client(monkeypatch):
+    # the clients are process-wide, so this test gets its own
+    monkeypatch.setattr(fandom, "clients", {})
+
+    client = get_client("genshin-impact")
+    assert client is get_client()
+    assert client is not get_client(hsr_fandom.Wiki)
+    assert client.session.headers["Accept-Encoding"] == "gzip, deflate"
+
+    pooled = FandomClient(hsr_fandom.Wiki, pool_size=3)
+    set_client(pooled)
+    assert get_client(hsr_fandom.Wiki) is pooled
+    assert pooled.session.get_adapter(pooled.api_url)._pool_maxsize == 3
+
+    with requests_mock.Mocker() as m:
+        m.get(pooled.api_url, json={"query": {"pages": {}}})
+        with mock.patch.object(
+            pooled.session, "get", wraps=pooled.session.get
+        ) as session_get:
+            hsr_fandom.get_pages_info([1, 2])
+
+        assert session_get.call_count == 1
+        assert m.last_request.headers["Connection"] == "keep-alive"
+
+
+def test_fetch_all():
+    # each query waits for the other, so they only finish when run concurrently
+    barrier = threading.Barrier(2, timeout=5)
+
+    def query(name: str):
+        def fetch():
+            barrier.wait()
+            return {"query": {"pages": {name: {}}}}
+
+        return fetch
+
+    assert fetch_all({"a": query("a"), "b": query("b")}, workers=2) == {
+        "a": {"query": {"pages": {"a": {}}}},
+        "b": {"query": {"pages": {"b": {}}}},
+    }
+
+    def fail():
+        raise Exception("failed")
+
+    with pytest.raises(Exception, match="failed"):
+        fetch_all({"a": fail})
+
+
+class FakeAsyncContent:
+    def __init__(self, data: bytes) -> None:
+        self.data = data
+
+    async def iter_chunked(self, size: int):
+        for i in range(0, len(self.data), size):
+            yield self.data[i : i + size]
+
+
+class FakeAsyncResponse:
+    def __init__(
+        self, body: dict | None = None, status: int = 200, data: bytes = b""
+    ) -> None:
+        self.body = body
+        self.status = status
+        self.content = FakeAsyncContent(data)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    async def json(self, content_type=None) -> dict:
+        return self.body
+
+
+class FakeAsyncSession:
+    def __init__(self, response: FakeAsyncResponse | None = None) -> None:
+        self.requests = []
+        self.response = response
+
+    def get(self, url: str, params: dict[str, str] | None = None) -> FakeAsyncResponse:
+        self.requests.append((url, dict(params or {})))
+        if self.response is not None:
+            return self.response
+        if "clcontinue" in params:
+            return FakeAsyncResponse(SecondQueryAllPage)
+        return FakeAsyncResponse(FirstQueryAllPage)
+
+
+def test_query_all_async():
+    session = FakeAsyncSession()
+    result = asyncio.run(
+        query_all_async(
+            {
+                "action": "query",
+                "generator": "categorymembers",
+                "gcmtitle": "Category:Event_Wishes",
+                "prop": "categories",
+                "cllimit": "max",
+                "gcmlimit": "max",
+                "format": "json",
+            },
+            session=session,
+        )
+    )
+
+    assert MergedQueryAllResult == result
+    assert len(session.requests) == 2
+    assert session.requests[1][1]["clcontinue"] == "209266|Event_Wishes"
+
+
+def test_get_page_content_async():
+    page = {"query": {"pages": [{"pageid": 7, "revisions": []}]}}
+
+    session = FakeAsyncSession(FakeAsyncResponse(page))
+    assert asyncio.run(fandom.get_page_content_async(7, session)) == {
+        **page,
+        "total_pages": 1,
+    }
+    assert session.requests[0][0] == "https://genshin-impact.fandom.com/api.php"
+    assert session.requests[0][1]["pageids"] == "7"
+
+    session = FakeAsyncSession(FakeAsyncResponse(page))
+    asyncio.run(hsr_fandom.get_page_content_async(7, session))
+    assert session.requests[0][0] == "https://honkai-star-rail.fandom.com/api.php"
+
+
+def test_download_image_async(tmp_path):
+    # several chunks of image data
+    data = bytes(range(256)) * 1000
+
+    session = FakeAsyncSession(FakeAsyncResponse(data=data))
+    asyncio.run(
+        fandom.download_character_image_async(tmp_path / "a.png", "Ganyu", 80, session)
+    )
+    assert (tmp_path / "a.png").read_bytes() == data
+    assert "file/Ganyu Icon.png&width=80" in session.requests[0][0]
+
+    session = FakeAsyncSession(FakeAsyncResponse(data=data))
+    asyncio.run(
+        hsr_fandom.download_weapon_image_async(
+            tmp_path / "b.png", "Arrows", 80, session
+        )
+    )
+    assert (tmp_path / "b.png").read_bytes() == data
+    assert "file/Light Cone Arrows Icon.png" in session.requests[0][0]
+
+    # nothing is written for a missing image
+    session = FakeAsyncSession(FakeAsyncResponse(status=404))
+    asyncio.run(
+        fandom.download_weapon_image_async(tmp_path / "c.png", "Missing", 80, session)
+    )
+    assert not (tmp_path / "c.png").exists()
+
+
+def without_fields(value, fields: set[str]):
+    if isinstance(value, dict):
+        return {
+            k: without_fields(v, fields) for k, v in value.items() if k not in fields
+        }
+    if isinstance(value, list):
+        return [without_fields(v, fields) for v in value]
+    return value
+
+
+def test_query_all_stream():
+    with requests_mock.Mocker() as m:
+        m.get(
+            "https://genshin-impact.fandom.com/api.php?action=query&generator=categorymembers&gcmtitle=Category%3AEvent_Wishes&prop=categories&cllimit=max&gcmlimit=max&format=json",
+            content=json.dumps(FirstQueryAllPage).encode(),
+        )
+        m.get(
+            "https://genshin-impact.fandom.com/api.php?action=query&generator=categorymembers&gcmtitle=Category%3AEvent_Wishes&prop=categories&cllimit=max&gcmlimit=max&format=json&continue=||&clcontinue=209266|Event_Wishes",
+            content=json.dumps(SecondQueryAllPage).encode(),
+        )
+        assert without_fields(MergedQueryAllResult, {"ns", "limits"}) == query_all(
+            {
+                "action": "query",
+                "generator": "categorymembers",
+                "gcmtitle": "Category:Event_Wishes",
+                "prop": "categories",
+                "cllimit": "max",
+                "gcmlimit": "max",
+                "format": "json",
+            },
+            stream=True,
+        )
+
+
+@pytest.mark.parametrize("size", [1, 2, 7, 1000])
+def test_decode_query_stream(size):
+    body = json.dumps(FirstQueryAllPage, indent=1).encode()
+    accumulator = QueryAccumulator()
+
+    response = decode_query_stream(
+        [body[i : i + size] for i in range(0, len(body), size)], accumulator
+    )
+
+    assert response["continue"] == FirstQueryAllPage["continue"]
+    assert accumulator.result == without_fields(
+        {"query": FirstQueryAllPage["query"]}, {"ns"}
+    )
+
+
+def test_json_stream():
+    stream = JsonStream([b"[12", b'34, "\xc3', b'\xa9", 1.5e', b"3, true, -", b"7]"])
+    assert [stream.value() for _ in stream.elements()] == [1234, "é", 1500.0, True, -7]